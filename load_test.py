@@ -0,0 +1,172 @@
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import pandas as pd
+
+
+thread_local = threading.local()
+
+
+def get_session():
+    # requests.Session is not thread-safe, so keep one per worker thread
+    if not hasattr(thread_local, "session"):
+        thread_local.session = requests.Session()
+    return thread_local.session
+
+
+def load_questions(file_path):
+    df = pd.read_csv(file_path)
+    return df["question"].dropna().tolist()
+
+
+def send_request(url, question, scheduled_at, timeout):
+    """Sends one question and returns (latency, status, error).
+
+    Latency is measured from the scheduled send time rather than the actual
+    one, so queueing delay on the client side is not hidden from the results.
+    """
+    try:
+        response = get_session().post(url, json={"question": question}, timeout=timeout)
+        latency = time.perf_counter() - scheduled_at
+        if response.status_code != 200:
+            return latency, response.status_code, response.text[:200]
+        return latency, response.status_code, None
+    except requests.exceptions.RequestException as e:
+        return time.perf_counter() - scheduled_at, None, str(e)
+
+
+def run_open_loop(url, questions, rate, duration, timeout, max_workers, poisson):
+    """Sends requests at a fixed arrival rate, independent of response times."""
+    results = []
+    lock = threading.Lock()
+
+    def task(question, scheduled_at):
+        result = send_request(url, question, scheduled_at, timeout)
+        with lock:
+            results.append(result)
+
+    start = time.perf_counter()
+    next_at = start
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while next_at - start < duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(task, random.choice(questions), next_at)
+            interval = random.expovariate(rate) if poisson else 1.0 / rate
+            next_at += interval
+
+    return results, time.perf_counter() - start
+
+
+def run_closed_loop(url, questions, concurrency, duration, timeout):
+    """Keeps a fixed number of requests in flight for the given duration."""
+    results = []
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def worker():
+        while time.perf_counter() - start < duration:
+            result = send_request(url, random.choice(questions), time.perf_counter(), timeout)
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return results, time.perf_counter() - start
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    k = (len(sorted_values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def print_report(results, elapsed):
+    total = len(results)
+    if total == 0:
+        print("No requests were sent.")
+        return
+
+    ok_latencies = sorted(latency for latency, _, error in results if error is None)
+    errors = [(status, error) for _, status, error in results if error is not None]
+
+    print("\n=== Load test report ===")
+    print(f"Requests sent:      {total}")
+    print(f"Elapsed:            {elapsed:.1f}s")
+    print(f"Throughput:         {total / elapsed:.2f} req/s ({len(ok_latencies) / elapsed:.2f} successful req/s)")
+    print(f"Error rate:         {len(errors) / total:.2%} ({len(errors)} errors)")
+
+    if ok_latencies:
+        print("Latency (successful requests):")
+        print(f"  min   {ok_latencies[0] * 1000:9.1f} ms")
+        for p in (50, 90, 95, 99):
+            print(f"  p{p:<4} {percentile(ok_latencies, p) * 1000:9.1f} ms")
+        print(f"  max   {ok_latencies[-1] * 1000:9.1f} ms")
+        print(f"  mean  {sum(ok_latencies) / len(ok_latencies) * 1000:9.1f} ms")
+
+    if errors:
+        by_status = {}
+        for status, error in errors:
+            key = status or "connection error"
+            count, first_error = by_status.get(key, (0, error))
+            by_status[key] = (count + 1, first_error)
+        print("Errors by status (first message):")
+        for status, (count, error) in by_status.items():
+            print(f"  {status}: {count} - {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Concurrent load generator for the /ask endpoint"
+    )
+    parser.add_argument("--url", default="http://localhost:5001", help="Base URL of the app")
+    parser.add_argument("--csv", default="./data/ground-truth-retrieval.csv", help="Questions to replay")
+    parser.add_argument("--duration", type=float, default=60.0, help="Test duration in seconds")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--rate", type=float, help="Open-loop arrival rate in requests per second")
+    mode.add_argument("--concurrency", type=int, help="Closed-loop number of concurrent clients")
+    parser.add_argument(
+        "--poisson", action="store_true", help="Use exponential inter-arrival times in open-loop mode"
+    )
+    parser.add_argument(
+        "--max-workers", type=int, default=256, help="Maximum in-flight requests in open-loop mode"
+    )
+    args = parser.parse_args()
+    if args.rate is not None and not args.rate > 0:
+        parser.error("--rate must be positive")
+    if args.concurrency is not None and args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    questions = load_questions(args.csv)
+    url = f"{args.url}/ask"
+
+    if args.rate is not None:
+        print(f"Open-loop test: {args.rate} req/s for {args.duration}s against {url}")
+        results, elapsed = run_open_loop(
+            url, questions, args.rate, args.duration, args.timeout, args.max_workers, args.poisson
+        )
+    else:
+        print(f"Closed-loop test: {args.concurrency} clients for {args.duration}s against {url}")
+        results, elapsed = run_closed_loop(
+            url, questions, args.concurrency, args.duration, args.timeout
+        )
+
+    print_report(results, elapsed)
+
+
+if __name__ == "__main__":
+    main()
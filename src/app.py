@@ -1,7 +1,9 @@
 from flask import Flask, request, jsonify
 import uuid
+import math
 import os
 from rag import rag_llm
+from restaurant_retreival_engine import UnknownZipCodeError
 import db
 
 
@@ -15,9 +17,30 @@ def ask():
             return jsonify({"error": "Missing question"}), 400
 
         question = data['question']
+
+        # Optional location for "near me" / "near this zip" questions
+        center = None
+        radius_km = None
+        zip_code = data.get('zip_code')
+        if (data.get('lat') is None) != (data.get('lng') is None):
+            return jsonify({"error": "lat and lng must be given together"}), 400
+        try:
+            if data.get('lat') is not None:
+                center = (float(data['lat']), float(data['lng']))
+            if data.get('radius_km') is not None:
+                radius_km = float(data['radius_km'])
+        except (TypeError, ValueError):
+            return jsonify({"error": "lat, lng and radius_km must be numbers"}), 400
+        if center is not None and not (-90 <= center[0] <= 90 and -180 <= center[1] <= 180):
+            return jsonify({"error": "lat must be between -90 and 90 and lng between -180 and 180"}), 400
+        if radius_km is not None and not (0 < radius_km < math.inf):
+            return jsonify({"error": "radius_km must be a positive number"}), 400
         
         # Run RAG pipeline
-        answer_data = rag_llm(question)
+        try:
+            answer_data = rag_llm(question, center=center, radius_km=radius_km, zip_code=zip_code)
+        except UnknownZipCodeError as e:
+            return jsonify({"error": str(e)}), 400
         # Generate a unique conversation ID
         conversation_id = str(uuid.uuid4())
         
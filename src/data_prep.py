@@ -0,0 +1,11 @@
+import os
+
+from ingest import RESTAURANTS_CSV, MENUS_CSV
+from restaurant_retreival_engine import DataLoader
+
+if __name__ == "__main__":
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    print("Preparing dataset snapshot...")
+    data_loader = DataLoader(RESTAURANTS_CSV, MENUS_CSV)
+    metadata = data_loader.ensure_snapshot()
+    print(f"Snapshot '{data_loader.snapshot_path}' is up to date (dataset hash {metadata['dataset_hash'][:12]}).")
@@ -1,11 +1,18 @@
 import os
 import psycopg2
 from psycopg2.extras import DictCursor
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
 
+from migrations import migrate, create_monthly_partition, month_start, next_month
+
 RUN_TIMEZONE_CHECK = os.getenv('RUN_TIMEZONE_CHECK', '1') == '1'
 
+JUDGE_NEGATIVE_FEEDBACK = os.getenv('JUDGE_NEGATIVE_FEEDBACK', '1') == '1'
+
+# Responses without a valid evaluation for a conversation before it is given up as UNKNOWN
+JUDGE_MAX_ATTEMPTS = int(os.getenv('JUDGE_MAX_ATTEMPTS', '3'))
+
 TZ_INFO = os.getenv("TZ", "America/New_York")
 tz = ZoneInfo(TZ_INFO)
 
@@ -17,45 +24,226 @@ def get_db_connection():
         password=os.getenv("POSTGRES_PASSWORD", "your_password"),
     ) 
 
-def init_db():
+def init_db(reset=False):
+    """Brings the schema up to date. With ``reset``, drops all tables first."""
+    conn = get_db_connection()
+    try:
+        if reset:
+            with conn.cursor() as cur:
+                cur.execute("DROP TABLE IF EXISTS feedback")
+                cur.execute("DROP TABLE IF EXISTS conversations CASCADE")
+                cur.execute("DROP TABLE IF EXISTS conversation_rollup_hourly")
+                cur.execute("DROP TABLE IF EXISTS feedback_rollup_hourly")
+                cur.execute("DROP TABLE IF EXISTS rollup_state")
+                cur.execute("DROP TABLE IF EXISTS rollup_dirty_buckets")
+                cur.execute("DROP TABLE IF EXISTS schema_migrations")
+            conn.commit()
+
+        applied = migrate(conn)
+        print(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+    finally:
+        conn.close()
+
+    ensure_conversation_partitions()
+
+
+def ensure_conversation_partitions(months_ahead=2):
+    """Creates monthly conversations partitions up to ``months_ahead`` months from now."""
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("DROP TABLE IF EXISTS feedback")
-            cur.execute("DROP TABLE IF EXISTS conversations")
+            start = month_start(datetime.now(timezone.utc))
+            for _ in range(months_ahead + 1):
+                create_monthly_partition(cur, start)
+                start = next_month(start)
+        conn.commit()
+    finally:
+        conn.close()
+
 
+def drop_expired_partitions(retention_months=12):
+    """Drops conversations partitions older than the retention period.
+
+    Dropping a whole partition is a cheap metadata operation, unlike a DELETE
+    over millions of rows. Feedback for the expired period is deleted by its
+    timestamp index. Hourly rollups are kept as long-term history.
+    """
+    cutoff = month_start(datetime.now(timezone.utc))
+    for _ in range(retention_months):
+        cutoff = month_start(cutoff - timedelta(days=1))
+
+    conn = get_db_connection()
+    dropped = []
+    try:
+        with conn.cursor() as cur:
             cur.execute("""
-                CREATE TABLE conversations (
-                    id TEXT PRIMARY KEY,
-                    question TEXT NOT NULL,
-                    answer TEXT NOT NULL,
-                    model_used TEXT NOT NULL,
-                    response_time FLOAT NOT NULL,
-                    relevance TEXT NOT NULL,
-                    relevance_explanation TEXT NOT NULL,
-                    prompt_tokens INTEGER NOT NULL,
-                    completion_tokens INTEGER NOT NULL,
-                    total_tokens INTEGER NOT NULL,
-                    eval_prompt_tokens INTEGER NOT NULL,
-                    eval_completion_tokens INTEGER NOT NULL,
-                    eval_total_tokens INTEGER NOT NULL,
-                    openai_cost FLOAT NOT NULL,
-                    timestamp TIMESTAMP WITH TIME ZONE NOT NULL
-                )
+                SELECT child.relname
+                FROM pg_inherits
+                JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+                JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+                WHERE parent.relname = 'conversations'
             """)
+            for (name,) in cur.fetchall():
+                if name == "conversations_default":
+                    continue
+                year, month = name[len("conversations_p"):].split("_")
+                start = datetime(int(year), int(month), 1, tzinfo=timezone.utc)
+                if next_month(start) <= cutoff:
+                    cur.execute(f"DROP TABLE {name}")
+                    dropped.append(name)
+
+            cur.execute("DELETE FROM conversations_default WHERE timestamp < %s", (cutoff,))
+            cur.execute("DELETE FROM feedback WHERE timestamp < %s", (cutoff,))
+        conn.commit()
+    finally:
+        conn.close()
+    return dropped
+
+
+# Re-aggregates the conversation rollup buckets in [start, end)
+CONVERSATION_ROLLUP_SQL = """
+    INSERT INTO conversation_rollup_hourly (
+        bucket, conversations, avg_response_time,
+        p50_response_time, p90_response_time, p99_response_time, max_response_time,
+        prompt_tokens, completion_tokens, total_tokens, cached_tokens,
+        eval_prompt_tokens, eval_completion_tokens, eval_total_tokens, eval_cached_tokens,
+        openai_cost, relevant, partly_relevant, non_relevant, unknown_relevance,
+        pending_relevance, not_judged, feedback_judged
+    )
+    SELECT
+        date_trunc('hour', timestamp) AS bucket,
+        COUNT(*),
+        AVG(response_time),
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY response_time),
+        percentile_cont(0.9) WITHIN GROUP (ORDER BY response_time),
+        percentile_cont(0.99) WITHIN GROUP (ORDER BY response_time),
+        MAX(response_time),
+        SUM(prompt_tokens),
+        SUM(completion_tokens),
+        SUM(total_tokens),
+        SUM(cached_tokens),
+        SUM(eval_prompt_tokens),
+        SUM(eval_completion_tokens),
+        SUM(eval_total_tokens),
+        SUM(eval_cached_tokens),
+        SUM(openai_cost),
+        -- Relevance counts cover the random sample only; answers judged
+        -- because of negative feedback would bias them
+        COUNT(*) FILTER (WHERE relevance = 'RELEVANT' AND NOT judged_for_feedback),
+        COUNT(*) FILTER (WHERE relevance = 'PARTLY_RELEVANT' AND NOT judged_for_feedback),
+        COUNT(*) FILTER (WHERE relevance = 'NON_RELEVANT' AND NOT judged_for_feedback),
+        COUNT(*) FILTER (WHERE relevance NOT IN
+            ('RELEVANT', 'PARTLY_RELEVANT', 'NON_RELEVANT', 'PENDING', 'JUDGING', 'NOT_JUDGED')
+            AND NOT judged_for_feedback),
+        COUNT(*) FILTER (WHERE relevance IN ('PENDING', 'JUDGING')),
+        COUNT(*) FILTER (WHERE relevance = 'NOT_JUDGED'),
+        COUNT(*) FILTER (WHERE relevance NOT IN ('PENDING', 'JUDGING') AND judged_for_feedback)
+    FROM conversations
+    WHERE timestamp >= date_trunc('hour', %s::timestamptz) AND timestamp < %s::timestamptz
+    GROUP BY 1
+    ON CONFLICT (bucket) DO UPDATE SET
+        conversations = EXCLUDED.conversations,
+        avg_response_time = EXCLUDED.avg_response_time,
+        p50_response_time = EXCLUDED.p50_response_time,
+        p90_response_time = EXCLUDED.p90_response_time,
+        p99_response_time = EXCLUDED.p99_response_time,
+        max_response_time = EXCLUDED.max_response_time,
+        prompt_tokens = EXCLUDED.prompt_tokens,
+        completion_tokens = EXCLUDED.completion_tokens,
+        total_tokens = EXCLUDED.total_tokens,
+        cached_tokens = EXCLUDED.cached_tokens,
+        eval_prompt_tokens = EXCLUDED.eval_prompt_tokens,
+        eval_completion_tokens = EXCLUDED.eval_completion_tokens,
+        eval_total_tokens = EXCLUDED.eval_total_tokens,
+        eval_cached_tokens = EXCLUDED.eval_cached_tokens,
+        openai_cost = EXCLUDED.openai_cost,
+        relevant = EXCLUDED.relevant,
+        partly_relevant = EXCLUDED.partly_relevant,
+        non_relevant = EXCLUDED.non_relevant,
+        unknown_relevance = EXCLUDED.unknown_relevance,
+        pending_relevance = EXCLUDED.pending_relevance,
+        not_judged = EXCLUDED.not_judged,
+        feedback_judged = EXCLUDED.feedback_judged
+"""
+
+
+def refresh_rollups(lookback=timedelta(hours=2)):
+    """Incrementally refreshes the hourly rollups.
+
+    Only buckets from the last watermark (minus ``lookback``, to catch rows that
+    were committed late or updated after insert) onwards are recomputed, plus
+    older buckets recorded in rollup_dirty_buckets, so each run scans a small,
+    index-backed slice of the raw tables.
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            # Serialize concurrent refreshes; released at commit
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('refresh_rollups'))")
+            cur.execute("SELECT now()")
+            refreshed_at = cur.fetchone()[0]
+
+            cur.execute("SELECT watermark FROM rollup_state WHERE name = 'hourly'")
+            row = cur.fetchone()
+            if row is None:
+                cur.execute("SELECT LEAST((SELECT MIN(timestamp) FROM conversations), (SELECT MIN(timestamp) FROM feedback))")
+                since = cur.fetchone()[0] or refreshed_at
+            else:
+                since = row[0] - lookback
+
+            # Hours updated after they left the lookback window, e.g. judged late;
+            # newer ones are re-aggregated anyway
+            cur.execute(
+                "DELETE FROM rollup_dirty_buckets RETURNING bucket, bucket < date_trunc('hour', %s::timestamptz)",
+                (since,),
+            )
+            dirty = sorted(bucket for bucket, is_old in cur.fetchall() if is_old)
+
+            cur.execute(CONVERSATION_ROLLUP_SQL, (since, "infinity"))
+            for bucket in dirty:
+                cur.execute(CONVERSATION_ROLLUP_SQL, (bucket, bucket + timedelta(hours=1)))
             cur.execute("""
-                CREATE TABLE feedback (
-                    id SERIAL PRIMARY KEY,
-                    conversation_id TEXT REFERENCES conversations(id),
-                    feedback INTEGER NOT NULL,
-                    timestamp TIMESTAMP WITH TIME ZONE NOT NULL
-                )
-            """)
+                INSERT INTO feedback_rollup_hourly
+                SELECT
+                    date_trunc('hour', timestamp) AS bucket,
+                    COUNT(*) FILTER (WHERE feedback > 0),
+                    COUNT(*) FILTER (WHERE feedback < 0)
+                FROM feedback
+                WHERE timestamp >= date_trunc('hour', %s::timestamptz)
+                GROUP BY 1
+                ON CONFLICT (bucket) DO UPDATE SET
+                    thumbs_up = EXCLUDED.thumbs_up,
+                    thumbs_down = EXCLUDED.thumbs_down
+            """, (since,))
+
+            cur.execute("""
+                INSERT INTO rollup_state (name, watermark) VALUES ('hourly', %s)
+                ON CONFLICT (name) DO UPDATE SET watermark = EXCLUDED.watermark
+            """, (refreshed_at,))
         conn.commit()
+        return refreshed_at
     finally:
         conn.close()
 
 
+def _mark_rollup_dirty(cur, timestamps):
+    """Records the hourly buckets of updated conversations for refresh_rollups.
+
+    DO UPDATE (rather than DO NOTHING) locks an existing row, so a concurrent
+    refresh_rollups can't consume it before this transaction commits.
+    """
+    if not timestamps:
+        return
+    cur.execute(
+        """
+        INSERT INTO rollup_dirty_buckets (bucket)
+        SELECT DISTINCT date_trunc('hour', ts) FROM unnest(%s::timestamptz[]) AS ts
+        ON CONFLICT (bucket) DO UPDATE SET bucket = EXCLUDED.bucket
+        """,
+        (list(timestamps),),
+    )
+
+
 def save_conversation(conversation_id, question, answer_data, timestamp=None):
     if timestamp is None:
         timestamp = datetime.now(tz)
@@ -67,9 +255,10 @@ def save_conversation(conversation_id, question, answer_data, timestamp=None):
                 """
                 INSERT INTO conversations 
                 (id, question, answer, model_used, response_time, relevance, 
-                relevance_explanation, prompt_tokens, completion_tokens, total_tokens, 
-                eval_prompt_tokens, eval_completion_tokens, eval_total_tokens, openai_cost, timestamp)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                relevance_explanation, prompt_tokens, completion_tokens, total_tokens, cached_tokens,
+                eval_prompt_tokens, eval_completion_tokens, eval_total_tokens, eval_cached_tokens,
+                cache_hit_ratio, openai_cost, timestamp)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 """,
                 (
                     conversation_id,
@@ -82,9 +271,12 @@ def save_conversation(conversation_id, question, answer_data, timestamp=None):
                     answer_data["prompt_tokens"],
                     answer_data["completion_tokens"],
                     answer_data["total_tokens"],
+                    answer_data["cached_tokens"],
                     answer_data["eval_prompt_tokens"],
                     answer_data["eval_completion_tokens"],
                     answer_data["eval_total_tokens"],
+                    answer_data["eval_cached_tokens"],
+                    answer_data["cache_hit_ratio"],
                     answer_data["openai_cost"],
                     timestamp
                 ),
@@ -104,24 +296,173 @@ def save_feedback(conversation_id, feedback, timestamp=None):
                 "INSERT INTO feedback (conversation_id, feedback, timestamp) VALUES (%s, %s, COALESCE(%s, CURRENT_TIMESTAMP))",
                 (conversation_id, feedback, timestamp),
             )
+            if feedback < 0 and JUDGE_NEGATIVE_FEEDBACK:
+                # Answers users disliked are always judged, even if not sampled
+                cur.execute(
+                    """
+                    UPDATE conversations
+                    SET relevance = 'PENDING',
+                        relevance_explanation = 'Queued for relevance judging',
+                        judged_for_feedback = TRUE
+                    WHERE id = %s AND relevance = 'NOT_JUDGED'
+                    RETURNING timestamp
+                    """,
+                    (conversation_id,),
+                )
+                _mark_rollup_dirty(cur, [row[0] for row in cur.fetchall()])
+        conn.commit()
+    finally:
+        conn.close()
+
+def judge_pending_conversations(judge_batch, batch_size=10, lease=timedelta(minutes=10)):
+    """Judges up to ``batch_size`` conversations waiting for relevance judging.
+
+    ``judge_batch`` takes a list of (question, answer) pairs and returns, per
+    pair, a dict with the relevance, explanation, eval token counts and cost
+    of judging it, or None if the response had no valid evaluation for it.
+
+    Rows are claimed in a short transaction (SKIP LOCKED, so several workers
+    can run side by side) and moved to 'JUDGING' with a ``lease``; no lock or
+    transaction is held during the LLM request. Rows without an evaluation go
+    back to 'PENDING' and are marked UNKNOWN after JUDGE_MAX_ATTEMPTS tries.
+    Returns the number of conversations claimed.
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute(
+                """
+                UPDATE conversations c
+                SET relevance = 'JUDGING', judge_lease_until = now() + %s
+                FROM (
+                    SELECT id, timestamp
+                    FROM conversations
+                    WHERE relevance = 'PENDING'
+                        OR (relevance = 'JUDGING' AND judge_lease_until < now())
+                    ORDER BY timestamp
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ) claimed
+                WHERE c.id = claimed.id AND c.timestamp = claimed.timestamp
+                RETURNING c.id, c.timestamp, c.question, c.answer, c.judge_lease_until
+                """,
+                (lease, batch_size),
+            )
+            rows = cur.fetchall()
         conn.commit()
+        if not rows:
+            return 0
+
+        try:
+            results = judge_batch([(row["question"], row["answer"]) for row in rows])
+        except Exception:
+            # Hand the rows back right away instead of waiting for the lease to expire
+            _release_judge_claims(conn, rows)
+            raise
+
+        with conn.cursor() as cur:
+            for row, result in zip(rows, results):
+                # A row whose lease expired may have been claimed by another worker since
+                claim = (row["id"], row["timestamp"], row["judge_lease_until"])
+                if result is None:
+                    cur.execute(
+                        """
+                        UPDATE conversations
+                        SET judge_attempts = judge_attempts + 1,
+                            judge_lease_until = NULL,
+                            relevance = CASE WHEN judge_attempts + 1 >= %s THEN 'UNKNOWN' ELSE 'PENDING' END,
+                            relevance_explanation = CASE WHEN judge_attempts + 1 >= %s
+                                THEN 'Failed to parse evaluation' ELSE relevance_explanation END
+                        WHERE id = %s AND timestamp = %s AND relevance = 'JUDGING' AND judge_lease_until = %s
+                        """,
+                        (JUDGE_MAX_ATTEMPTS, JUDGE_MAX_ATTEMPTS, *claim),
+                    )
+                    continue
+
+                cur.execute(
+                    """
+                    UPDATE conversations
+                    SET relevance = %s,
+                        relevance_explanation = %s,
+                        judge_lease_until = NULL,
+                        eval_prompt_tokens = %s,
+                        eval_completion_tokens = %s,
+                        eval_total_tokens = %s,
+                        eval_cached_tokens = %s,
+                        cache_hit_ratio = (cached_tokens + %s)::float / NULLIF(prompt_tokens + %s, 0),
+                        openai_cost = openai_cost + %s
+                    WHERE id = %s AND timestamp = %s AND relevance = 'JUDGING' AND judge_lease_until = %s
+                    """,
+                    (
+                        result["relevance"],
+                        result["relevance_explanation"],
+                        result["eval_prompt_tokens"],
+                        result["eval_completion_tokens"],
+                        result["eval_total_tokens"],
+                        result["eval_cached_tokens"],
+                        result["eval_cached_tokens"],
+                        result["eval_prompt_tokens"],
+                        result["openai_cost"],
+                        *claim,
+                    ),
+                )
+            # Judged rows are often older than the rollup lookback window
+            _mark_rollup_dirty(cur, [row["timestamp"] for row in rows])
+        conn.commit()
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         conn.close()
 
+
+def _release_judge_claims(conn, rows):
+    conn.rollback()
+    try:
+        with conn.cursor() as cur:
+            for row in rows:
+                cur.execute(
+                    """
+                    UPDATE conversations
+                    SET relevance = 'PENDING', judge_lease_until = NULL
+                    WHERE id = %s AND timestamp = %s AND relevance = 'JUDGING' AND judge_lease_until = %s
+                    """,
+                    (row["id"], row["timestamp"], row["judge_lease_until"]),
+                )
+        conn.commit()
+    except Exception as e:
+        # The leases expire on their own, so this is not fatal
+        conn.rollback()
+        print(f"Could not release judge claims: {e}")
+
+
 def get_recent_conversations(limit=5, relevance=None):
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            query = """
+            # Pick the newest conversations first (an index scan on timestamp),
+            # then join feedback for just those rows
+            where = ""
+            params = []
+            if relevance:
+                where = "WHERE relevance = %s"
+                params.append(relevance)
+            query = f"""
                 SELECT c.*, f.feedback
-                FROM conversations c
+                FROM (
+                    SELECT * FROM conversations
+                    {where}
+                    ORDER BY timestamp DESC
+                    LIMIT %s
+                ) c
                 LEFT JOIN feedback f ON c.id = f.conversation_id
+                ORDER BY c.timestamp DESC
+                LIMIT %s
             """
-            if relevance:
-                query += f" WHERE c.relevance = '{relevance}'"
-            query += " ORDER BY c.timestamp DESC LIMIT %s"
+            params.extend([limit, limit])
 
-            cur.execute(query, (limit,))
+            cur.execute(query, params)
             return cur.fetchall()
     finally:
         conn.close()
@@ -131,11 +472,29 @@ def get_feedback_stats():
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
+            # Closed hours come from the rollup, only the tail since the last
+            # refreshed hour is counted from the raw table
             cur.execute("""
-                SELECT 
-                    SUM(CASE WHEN feedback > 0 THEN 1 ELSE 0 END) as thumbs_up,
-                    SUM(CASE WHEN feedback < 0 THEN 1 ELSE 0 END) as thumbs_down
-                FROM feedback
+                WITH cutoff AS (
+                    SELECT COALESCE(
+                        (SELECT date_trunc('hour', watermark) FROM rollup_state WHERE name = 'hourly'),
+                        '-infinity'::timestamptz
+                    ) AS ts
+                )
+                SELECT
+                    COALESCE(r.thumbs_up, 0) + COALESCE(t.thumbs_up, 0) as thumbs_up,
+                    COALESCE(r.thumbs_down, 0) + COALESCE(t.thumbs_down, 0) as thumbs_down
+                FROM (
+                    SELECT SUM(thumbs_up) AS thumbs_up, SUM(thumbs_down) AS thumbs_down
+                    FROM feedback_rollup_hourly, cutoff
+                    WHERE bucket < cutoff.ts
+                ) r, (
+                    SELECT
+                        SUM(CASE WHEN feedback > 0 THEN 1 ELSE 0 END) as thumbs_up,
+                        SUM(CASE WHEN feedback < 0 THEN 1 ELSE 0 END) as thumbs_down
+                    FROM feedback, cutoff
+                    WHERE timestamp >= cutoff.ts
+                ) t
             """)
             return cur.fetchone()
     finally:
@@ -164,13 +523,14 @@ def check_timezone():
             cur.execute("""
                 INSERT INTO conversations 
                 (id, question, answer, model_used, response_time, relevance, 
-                relevance_explanation, prompt_tokens, completion_tokens, total_tokens, 
-                eval_prompt_tokens, eval_completion_tokens, eval_total_tokens, openai_cost, timestamp)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                relevance_explanation, prompt_tokens, completion_tokens, total_tokens, cached_tokens,
+                eval_prompt_tokens, eval_completion_tokens, eval_total_tokens, eval_cached_tokens,
+                cache_hit_ratio, openai_cost, timestamp)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 RETURNING timestamp;
             """, 
             ('test', 'test question', 'test answer', 'test model', 0.0, 0.0, 
-             'test explanation', 0, 0, 0, 0, 0, 0, 0.0, py_time))
+             'test explanation', 0, 0, 0, 0, 0, 0, 0, 0, 0.0, 0.0, py_time))
 
             inserted_time = cur.fetchone()[0]
             print(f"Inserted time (UTC): {inserted_time}")
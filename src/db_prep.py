@@ -1,4 +1,5 @@
 import os
+import sys
 from dotenv import load_dotenv
 
 os.environ['RUN_TIMEZONE_CHECK'] = '0'
@@ -8,5 +9,7 @@ from db import init_db
 load_dotenv()
 
 if __name__ == "__main__":
-    print("Initializing database...")
-    init_db()
\ No newline at end of file
+    # Migrations are non-destructive; --reset wipes all data and starts over
+    reset = "--reset" in sys.argv[1:]
+    print("Resetting database..." if reset else "Initializing database...")
+    init_db(reset=reset)
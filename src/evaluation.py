@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+import tqdm.auto as tqdm_auto
+
+from llm_utility import RAGQueryEngine
+
+
+class RateLimiter:
+    """Token bucket limiting how many LLM requests are started per minute."""
+
+    def __init__(self, requests_per_minute: float, burst: float = 1.0):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(burst, self.rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class EvaluationRunner:
+    """Runs the RAG pipeline and relevance judge over a question set.
+
+    LLM calls run concurrently on a bounded thread pool, every finished record is
+    appended to a JSONL checkpoint, and records already in the checkpoint are
+    skipped, so an interrupted run picks up where it stopped.
+    """
+
+    # query_llm sends one answer request and one judge request per record
+    LLM_CALLS_PER_RECORD = 2
+
+    def __init__(
+        self,
+        rag_engine: RAGQueryEngine,
+        checkpoint_path: str,
+        max_workers: int = 8,
+        requests_per_minute: float = 300,
+        num_results: int = 5,
+    ):
+        self.rag = rag_engine
+        self.checkpoint_path = checkpoint_path
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(requests_per_minute, burst=self.LLM_CALLS_PER_RECORD)
+        self.num_results = num_results
+        self._write_lock = threading.Lock()
+
+    @staticmethod
+    def record_key(record: Dict[str, Any]) -> str:
+        # Ground truth has several questions per document id
+        return json.dumps([str(record.get("id")), record["question"]])
+
+    def load_checkpoint(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.checkpoint_path):
+            return []
+
+        rows = []
+        with open(self.checkpoint_path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A partially written last line from a killed run
+                    print(f"Skipping corrupt checkpoint line: {line[:80]}")
+        return rows
+
+    def _append_checkpoint(self, row: Dict[str, Any]) -> None:
+        with self._write_lock:
+            with open(self.checkpoint_path, "a") as f:
+                f.write(json.dumps(row) + "\n")
+                f.flush()
+
+    def evaluate_record(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        question = record["question"]
+        results = self.rag.retrieval_index.search(question, num_results=self.num_results)
+        search_results = [point.payload for point in results.points]
+
+        self.rate_limiter.acquire(self.LLM_CALLS_PER_RECORD)
+        answer_data = self.rag.query_llm(question, search_results, judge=True)
+
+        return {
+            "key": self.record_key(record),
+            "id": record.get("id"),
+            "question": question,
+            **answer_data,
+        }
+
+    def run(self, records: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        """Evaluates every record not yet in the checkpoint.
+
+        Returns all checkpointed rows (old and new) and the number of failures.
+        """
+        rows = self.load_checkpoint()
+        done = {row["key"] for row in rows}
+        pending = [r for r in records if self.record_key(r) not in done]
+        print(f"{len(done)} records already evaluated, {len(pending)} to go.")
+
+        failures = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.evaluate_record, r): r for r in pending}
+            for future in tqdm_auto.tqdm(as_completed(futures), total=len(futures), desc="Evaluating"):
+                try:
+                    row = future.result()
+                except Exception as e:
+                    # Not checkpointed, so the record is retried on the next run
+                    failures += 1
+                    print(f"Failed on '{futures[future]['question']}': {e}")
+                    continue
+                self._append_checkpoint(row)
+                rows.append(row)
+
+        return rows, failures
+
+    @staticmethod
+    def build_report(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        if not rows:
+            return {"evaluated": 0}
+
+        n = len(rows)
+        relevance = Counter(row["relevance"] for row in rows)
+        total_cost = sum(row["openai_cost"] for row in rows)
+
+        return {
+            "evaluated": n,
+            "relevance": {label: count / n for label, count in relevance.most_common()},
+            "mean_response_time": sum(row["response_time"] for row in rows) / n,
+            "prompt_tokens": sum(row["prompt_tokens"] for row in rows),
+            "completion_tokens": sum(row["completion_tokens"] for row in rows),
+            "cached_tokens": sum(row.get("cached_tokens", 0) + row.get("eval_cached_tokens", 0) for row in rows),
+            "eval_prompt_tokens": sum(row["eval_prompt_tokens"] for row in rows),
+            "eval_completion_tokens": sum(row["eval_completion_tokens"] for row in rows),
+            "total_cost": total_cost,
+            "cost_per_question": total_cost / n,
+        }
+
+
+def print_report(report: Dict[str, Any], failures: int = 0) -> None:
+    print("\n=== RAG evaluation report ===")
+    print(f"Evaluated questions: {report['evaluated']}")
+    if failures:
+        print(f"Failed (will be retried on resume): {failures}")
+    if not report["evaluated"]:
+        return
+
+    print("Relevance:")
+    for label, share in report["relevance"].items():
+        print(f"  {label:<16} {share:.2%}")
+    print(f"Mean response time:  {report['mean_response_time']:.2f}s")
+    print(f"Answer tokens:       {report['prompt_tokens']} prompt / {report['completion_tokens']} completion")
+    print(f"Judge tokens:        {report['eval_prompt_tokens']} prompt / {report['eval_completion_tokens']} completion")
+    prompt_tokens = report["prompt_tokens"] + report["eval_prompt_tokens"]
+    if prompt_tokens:
+        print(f"Cached input tokens: {report['cached_tokens']} ({report['cached_tokens'] / prompt_tokens:.2%} of prompt tokens)")
+    print(f"Total cost:          ${report['total_cost']:.4f} (${report['cost_per_question']:.6f} per question)")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Parallel, resumable RAG relevance evaluation"
+    )
+    parser.add_argument("--csv", default="../data/ground-truth-retrieval.csv", help="Ground truth questions")
+    parser.add_argument("--checkpoint", default="../data/rag-evaluation.jsonl", help="Append-only results file")
+    parser.add_argument("--workers", type=int, default=8, help="Maximum concurrent records")
+    parser.add_argument("--rpm", type=float, default=300, help="Maximum LLM requests per minute")
+    parser.add_argument("--limit", type=int, help="Only evaluate the first N questions")
+    args = parser.parse_args(argv)
+
+    records = pd.read_csv(args.csv).to_dict(orient="records")
+    if args.limit:
+        records = records[: args.limit]
+
+    runner = EvaluationRunner(
+        RAGQueryEngine(),
+        checkpoint_path=args.checkpoint,
+        max_workers=args.workers,
+        requests_per_minute=args.rpm,
+    )
+    rows, failures = runner.run(records)
+
+    # Only report on the requested question set, even if the checkpoint holds more
+    keys = {runner.record_key(r) for r in records}
+    print_report(runner.build_report([row for row in rows if row["key"] in keys]), failures)
+
+
+if __name__ == "__main__":
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    main()
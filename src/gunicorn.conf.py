@@ -0,0 +1,87 @@
+"""Gunicorn settings for the pre-fork production server.
+
+Run from the src directory with:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import os
+import resource
+from time import time
+
+bind = f"0.0.0.0:{os.getenv('APP_PORT', '5001')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "gthread"
+threads = int(os.getenv("WORKER_THREADS", "4"))
+timeout = 120
+
+# Load the app (engine, embedding model) in the master, then fork
+preload_app = True
+
+# Recycle workers periodically; jitter keeps them from restarting all at once
+max_requests = int(os.getenv("MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "100"))
+graceful_timeout = 30
+
+# One ONNX Runtime thread per worker: workers already use every core, and a
+# thread pool created before fork would not survive in the children
+os.environ.setdefault("EMBEDDING_THREADS", "1")
+
+_forked_at = {}
+
+
+def memory_usage():
+    """RSS, PSS and shared memory of this process in MB.
+
+    PSS splits shared pages between the processes mapping them, so summing it
+    over all workers gives the real footprint of copy-on-write sharing.
+    """
+    usage = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty"):
+                    usage[key] = int(value.split()[0]) / 1024
+    except OSError:
+        # Not Linux: ru_maxrss is the peak RSS (KB on Linux, bytes on macOS)
+        usage["Rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return usage
+
+
+def format_memory(usage):
+    shared = usage.get("Shared_Clean", 0) + usage.get("Shared_Dirty", 0)
+    text = f"RSS {usage['Rss']:.1f} MB"
+    if "Pss" in usage:
+        text += f", PSS {usage['Pss']:.1f} MB, shared {shared:.1f} MB"
+    return text
+
+
+def when_ready(server):
+    import wsgi
+
+    server.log.info(
+        "App preloaded in %.2fs, master %s", wsgi.STARTUP_SECONDS, format_memory(memory_usage())
+    )
+
+
+def pre_fork(server, worker):
+    _forked_at[worker.age] = time()
+
+
+def post_fork(server, worker):
+    import rag
+
+    # Sockets opened by the master must not be shared between workers
+    rag.reconnect()
+
+
+def post_worker_init(worker):
+    started = _forked_at.get(worker.age)
+    took = time() - started if started else 0.0
+    worker.log.info(
+        "Worker %s ready in %.2fs, %s", worker.pid, took, format_memory(memory_usage())
+    )
+
+
+def worker_exit(server, worker):
+    server.log.info("Worker %s exiting, %s", worker.pid, format_memory(memory_usage()))
@@ -1,6 +1,14 @@
+import os
+import json
+import argparse
 from typing import Any, Optional
 from restaurant_retreival_engine import RestaurantVectorStore, EmbeddingService, DataLoader, RestaurantSearchEngine
 
+RESTAURANTS_CSV = "../data/restaurants.csv"
+MENUS_CSV = "../data/restaurant-menus.csv"
+# Written by create_index and restore_index: which dataset and model the index was built from
+INDEX_MANIFEST = "../data/index-manifest.json"
+
 # Cached instances - created once and reused
 _vector_store: Optional[RestaurantVectorStore] = None
 _embedding: Optional[EmbeddingService] = None
@@ -11,16 +19,19 @@ def _get_or_create_instances():
     global _vector_store, _embedding, _data_loader
     
     if _vector_store is None:
-        _vector_store = RestaurantVectorStore()
+        # QDRANT_PATH selects the embedded backend stored in that directory instead of a server
+        _vector_store = RestaurantVectorStore(path=os.getenv("QDRANT_PATH"))
     
     if _embedding is None:
-        _embedding = EmbeddingService()
+        threads = os.getenv("EMBEDDING_THREADS")
+        _embedding = EmbeddingService(
+            threads=int(threads) if threads else None,
+            batch_window_ms=float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "2")),
+            max_batch_size=int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32")),
+        )
     
     if _data_loader is None:
-        _data_loader = DataLoader(
-            "../data/restaurants.csv",
-            "../data/restaurant-menus.csv"
-        )
+        _data_loader = DataLoader(RESTAURANTS_CSV, MENUS_CSV)
     
     return _vector_store, _embedding, _data_loader
 
@@ -35,10 +46,16 @@ def load_index():
         print(f"Collection '{collection_name}' already exists. Skipping indexing.")
     else:
         print(f"Collection '{collection_name}' does not exist. Create the index first.")
+
+    # Indexes built before the restaurant-level collection existed use single-stage search
+    restaurant_collection = engine.restaurant_collection_for(collection_name)
+    engine.hierarchical = vector_store.client.collection_exists(collection_name=restaurant_collection)
+    if engine.hierarchical:
+        print(f"Using two-stage search over '{restaurant_collection}' and '{collection_name}'.")
     
     return engine
 
-def create_index():
+def create_index(wait: bool = False):
     vector_store, embedding, data_loader = _get_or_create_instances()
 
     engine = RestaurantSearchEngine(vector_store, embedding, data_loader)
@@ -47,10 +64,113 @@ def create_index():
     collection_name = engine.default_collection
     print(f"Collection '{collection_name}' Creating and indexing...")
     engine.initialize_collection()
+    _write_manifest({
+        "collection": collection_name,
+        "embedding_model": embedding.model_name,
+        "dataset_hash": data_loader.dataset_hash(),
+    })
     thread = engine.index_data()
     
     # Optionally block until indexing finishes
-    # thread.join()
+    if wait:
+        thread.join()
     
     return True
-    
\ No newline at end of file
+
+def _read_manifest() -> dict:
+    if not os.path.exists(INDEX_MANIFEST):
+        return {}
+    with open(INDEX_MANIFEST) as f:
+        return json.load(f)
+
+def _write_manifest(manifest: dict) -> None:
+    os.makedirs(os.path.dirname(INDEX_MANIFEST), exist_ok=True)
+    with open(INDEX_MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+def _snapshot_path(directory: str, collection_name: str) -> str:
+    return os.path.join(directory, f"{collection_name}.snapshot.parquet")
+
+def _index_collections(engine: RestaurantSearchEngine):
+    collection_name = engine.default_collection
+    return [engine.restaurant_collection_for(collection_name), collection_name]
+
+def export_index(directory: str):
+    """Exports the menu-item and restaurant collections to one snapshot file each."""
+    vector_store, embedding, data_loader = _get_or_create_instances()
+    engine = RestaurantSearchEngine(vector_store, embedding, data_loader)
+
+    # The hash of the data the index was built from, not of whatever CSVs are on disk now
+    manifest = _read_manifest()
+    dataset_hash = manifest.get("dataset_hash") if manifest.get("collection") == engine.default_collection else None
+    if dataset_hash is None:
+        print(f"No index manifest at '{INDEX_MANIFEST}', exporting without a dataset hash.")
+
+    os.makedirs(directory, exist_ok=True)
+    for collection_name in _index_collections(engine):
+        if not vector_store.client.collection_exists(collection_name=collection_name):
+            print(f"Collection '{collection_name}' does not exist. Skipping.")
+            continue
+        vector_store.export_snapshot(
+            collection_name,
+            _snapshot_path(directory, collection_name),
+            embedding_model=embedding.model_name,
+            dataset_hash=dataset_hash,
+        )
+
+def restore_index(directory: str, force: bool = False):
+    """Bulk-loads snapshots written by export_index instead of re-embedding the dataset."""
+    vector_store, embedding, data_loader = _get_or_create_instances()
+    engine = RestaurantSearchEngine(vector_store, embedding, data_loader)
+
+    # New nodes usually don't have the CSVs, which is the point of restoring
+    dataset_hash = data_loader.source_dataset_hash()
+
+    restored = False
+    restored_hash = None
+    for collection_name in _index_collections(engine):
+        path = _snapshot_path(directory, collection_name)
+        if not os.path.exists(path):
+            print(f"Snapshot '{path}' not found. Skipping.")
+            continue
+        header = vector_store.restore_snapshot(path, embedding_model=embedding.model_name, force=force)
+        restored = True
+        restored_hash = header["dataset_hash"]
+        if dataset_hash and header["dataset_hash"] and header["dataset_hash"] != dataset_hash:
+            print(f"Warning: '{collection_name}' was built from a different version of the dataset.")
+
+    # Lets this node export the restored index again with the right dataset hash
+    if restored:
+        _write_manifest({
+            "collection": engine.default_collection,
+            "embedding_model": embedding.model_name,
+            "dataset_hash": restored_hash,
+        })
+
+if __name__ == "__main__":
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    parser = argparse.ArgumentParser(description="Build, export or restore the restaurant search index")
+    parser.add_argument(
+        "--path", default=os.getenv("QDRANT_PATH"),
+        help="Use the embedded Qdrant backend stored in this directory instead of QDRANT_HOST",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("create", help="Embed the dataset and index it into Qdrant")
+    export_parser = subparsers.add_parser("export", help="Export the index to snapshot files")
+    export_parser.add_argument("directory", help="Directory to write the snapshots to")
+    restore_parser = subparsers.add_parser("restore", help="Restore the index from snapshot files")
+    restore_parser.add_argument("directory", help="Directory containing the snapshots")
+    restore_parser.add_argument(
+        "--force", action="store_true", help="Load into collections that already contain points"
+    )
+    args = parser.parse_args()
+    if args.path:
+        os.environ["QDRANT_PATH"] = args.path
+
+    if args.command == "create":
+        create_index(wait=True)
+    elif args.command == "export":
+        export_index(args.directory)
+    else:
+        restore_index(args.directory, force=args.force)
@@ -0,0 +1,88 @@
+import os
+import time
+import argparse
+from dotenv import load_dotenv
+
+os.environ['RUN_TIMEZONE_CHECK'] = '0'
+
+# db reads JUDGE_MAX_ATTEMPTS and JUDGE_NEGATIVE_FEEDBACK at import time, so .env must be loaded first
+load_dotenv()
+
+from db import judge_pending_conversations
+from llm_utility import RAGQueryEngine
+
+MAX_BACKOFF_SECONDS = 300
+
+
+def split_evenly(total, n):
+    """Splits an integer total into n parts that sum to it."""
+    base, remainder = divmod(total, n)
+    return [base + (1 if i < remainder else 0) for i in range(n)]
+
+
+def make_judge(rag_engine):
+    def judge_batch(items):
+        evaluations, tokens = rag_engine.evaluate_relevance_batch(items)
+        cost = rag_engine.calculate_openai_cost(tokens)
+
+        # One request judged every item, so its usage is shared between the items it evaluated
+        judged = [i for i, evaluation in enumerate(evaluations) if evaluation is not None]
+        if len(judged) < len(items):
+            print(f"No valid evaluation for {len(items) - len(judged)} of {len(items)} items, they will be retried")
+        if not judged:
+            return evaluations
+
+        n = len(judged)
+        shares = {key: split_evenly(value, n) for key, value in tokens.items()}
+        results = [None] * len(items)
+        for share, i in enumerate(judged):
+            results[i] = {
+                "relevance": evaluations[i]["Relevance"],
+                "relevance_explanation": evaluations[i]["Explanation"],
+                "eval_prompt_tokens": shares["prompt_tokens"][share],
+                "eval_completion_tokens": shares["completion_tokens"][share],
+                "eval_total_tokens": shares["total_tokens"][share],
+                "eval_cached_tokens": shares["cached_tokens"][share],
+                "openai_cost": cost / n,
+            }
+        return results
+    return judge_batch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Judge the relevance of sampled answers in batches"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=int(os.getenv("JUDGE_BATCH_SIZE", "10")),
+        help="Answers scored per judge request"
+    )
+    parser.add_argument(
+        "--interval", type=int, default=0,
+        help="Keep polling every N seconds instead of stopping when nothing is pending"
+    )
+    args = parser.parse_args()
+
+    judge_batch = make_judge(RAGQueryEngine(load_retrieval_index=False))
+
+    failures = 0
+    while True:
+        try:
+            claimed = judge_pending_conversations(judge_batch, batch_size=args.batch_size)
+        except Exception as e:
+            if not args.interval:
+                raise
+            # An OpenAI or database outage shouldn't stop a long-running worker
+            failures += 1
+            delay = min(args.interval * 2 ** (failures - 1), MAX_BACKOFF_SECONDS)
+            print(f"Judging failed ({e}), retrying in {delay}s")
+            time.sleep(delay)
+            continue
+        failures = 0
+
+        if claimed:
+            print(f"Judged a batch of {claimed} conversations")
+            continue
+        if not args.interval:
+            break
+        time.sleep(args.interval)
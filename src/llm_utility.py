@@ -2,22 +2,94 @@ from typing import List, Dict, Optional, Tuple
 from openai import OpenAI
 from time import time
 from ingest import load_index
+import random
 import json
 import os
 
+# USD per 1M tokens; cached input tokens are billed at a discount
+MODEL_PRICES = {
+    "gpt-5": {"input": 1.25, "cached_input": 0.125, "output": 10.00},
+    "gpt-5-mini": {"input": 0.25, "cached_input": 0.025, "output": 2.00},
+    "gpt-5-nano": {"input": 0.05, "cached_input": 0.005, "output": 0.40},
+    "gpt-4.1": {"input": 2.00, "cached_input": 0.50, "output": 8.00},
+    "gpt-4.1-mini": {"input": 0.40, "cached_input": 0.10, "output": 1.60},
+    "gpt-4.1-nano": {"input": 0.10, "cached_input": 0.025, "output": 0.40},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+}
+
+# Relevance of answers waiting for the batch judge, and of answers not sampled for judging
+RELEVANCE_PENDING = "PENDING"
+RELEVANCE_NOT_JUDGED = "NOT_JUDGED"
+
+EMPTY_TOKEN_STATS = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0}
+
+# Structured output of the batch judge; the API guarantees responses match it
+BATCH_EVALUATION_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "relevance_evaluations",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "evaluations": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "Relevance": {"type": "string", "enum": ["NON_RELEVANT", "PARTLY_RELEVANT", "RELEVANT"]},
+                            "Explanation": {"type": "string"},
+                        },
+                        "required": ["id", "Relevance", "Explanation"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["evaluations"],
+            "additionalProperties": False,
+        },
+    },
+}
+
 class RAGQueryEngine:
-    def __init__(self):
-        openai_key = os.getenv("OPENAI_API_KEY")
-        self.client = OpenAI(api_key=openai_key)
+    def __init__(self, load_retrieval_index: bool = True):
+        self.client = self._create_client()
         self.model = "gpt-5-nano"
+        # Share of production answers sent to the relevance judge
+        self.judge_sample_rate = float(os.getenv("JUDGE_SAMPLE_RATE", "1.0"))
+        # Static instructions come first and the variable CONTEXT/QUESTION last, so the
+        # provider's automatic prefix caching can reuse the shared prefix across requests.
+        # Note that prompts are only cached once their first 1024 tokens match, and the
+        # static parts below are shorter than that, so they are not cached yet. They are not
+        # padded with extra instructions, which would change the answers and the judge's labels.
         self.prompt_template = """
                     You're a restaurant connoisseur. Answer the QUESTION based on the CONTEXT from our restaurant and menu items database.
                     Use only the facts from the CONTEXT when answering the QUESTION.
 
-                    QUESTION: {question}
+                    The CONTEXT is a list of records separated by blank lines. Each record is one menu item
+                    at one restaurant location and has the following fields:
+                    - restaurant_name: name of the restaurant
+                    - score: average customer rating of the restaurant, from 0 to 5
+                    - ratings_count: number of customer ratings behind the score
+                    - restaurant_category: cuisines and categories the restaurant is listed under, separated by commas
+                    - price_range: relative price level of the restaurant, from $ (cheapest) to $$$$ (most expensive)
+                    - full_address: street address of the restaurant
+                    - zip_code: ZIP code of the restaurant
+                    - lat, lng: coordinates of the restaurant
+                    - restaurant_id: internal identifier of the restaurant; records with the same restaurant_id belong to the same location
+                    - menu_category: section of the menu the item is listed in
+                    - menu_item_name: name of the dish or product as it appears on the menu
+                    - description: description of the menu item as written by the restaurant
+                    - item_price: price of the menu item in USD
+                    - city, state: city and state of the restaurant
+                    A value of "Not available" means the field is missing from the database.
 
                     CONTEXT:
                     {context}
+
+                    QUESTION: {question}
                     """.strip()
         self.record_template = """
                     restaurant_name: {name_x}
@@ -37,17 +109,14 @@ class RAGQueryEngine:
                     city: {city}
                     state: {state}
                     """.strip()
-        self.evaluation_prompt_template = """
+        # The single and the batch judge prompt share these instructions as their static prefix
+        judge_guidelines = """
             You are an expert evaluator for a RAG system.
             Your task is to analyze the relevance of the generated answer to the given question.
             Based on the relevance of the generated answer, you will classify it
             as "NON_RELEVANT", "PARTLY_RELEVANT", or "RELEVANT".
-
-            Here is the data for evaluation:
-
-            Question: {question}
-            Generated Answer: {answer}
-
+            """.strip()
+        self.evaluation_prompt_template = judge_guidelines + "\n\n" + """
             Please analyze the content and context of the generated answer in relation to the question
             and provide your evaluation in parsable JSON without using code blocks:
 
@@ -55,8 +124,39 @@ class RAGQueryEngine:
             "Relevance": "NON_RELEVANT" | "PARTLY_RELEVANT" | "RELEVANT",
             "Explanation": "[Provide a brief explanation for your evaluation]"
             }}
+
+            Here is the data for evaluation:
+
+            Question: {question}
+            Generated Answer: {answer}
+            """.strip()
+        self.batch_evaluation_prompt_template = judge_guidelines + "\n\n" + """
+            Evaluate every item independently of the others.
+            Please analyze the content and context of each generated answer in relation to its question
+            and return one evaluation per item, with the ID of the item, in the "evaluations" list.
+
+            Here are the items for evaluation:
+
+            {items}
+            """.strip()
+        self.batch_evaluation_item_template = """
+            ID: {id}
+            Question: {question}
+            Generated Answer: {answer}
             """.strip()
-        self.retrieval_index = load_index()
+        self.retrieval_index = load_index() if load_retrieval_index else None
+
+    @staticmethod
+    def _create_client() -> OpenAI:
+        openai_key = os.getenv("OPENAI_API_KEY")
+        # OPENAI_BASE_URL lets the app talk to the local stub server (stub_llm_server.py)
+        return OpenAI(api_key=openai_key, base_url=os.getenv("OPENAI_BASE_URL"))
+
+    def reconnect(self) -> None:
+        """Re-creates the OpenAI and Qdrant clients, whose connection pools can't be shared across a fork."""
+        self.client = self._create_client()
+        if self.retrieval_index is not None:
+            self.retrieval_index.vector_store.reconnect()
 
     def _build_context(self, search_results: List[Dict]) -> str:
         """Formats documents into the record template."""
@@ -70,14 +170,26 @@ class RAGQueryEngine:
         context = self._build_context(search_results)
         return self.prompt_template.format(question=query, context=context).strip()
 
-    def query_llm(self, query: str, search_results: List[Dict]) -> Dict:
-        """Formats a prompt, queries the LLM, and returns answer + token stats."""
+    def query_llm(self, query: str, search_results: List[Dict], judge: Optional[bool] = None) -> Dict:
+        """Formats a prompt, queries the LLM, and returns answer + token stats.
+
+        With ``judge=True`` the answer is judged inline. Otherwise a
+        ``judge_sample_rate`` share of answers is marked PENDING for the batch
+        judge (judge_worker.py) and the rest NOT_JUDGED.
+        """
         prompt = self.build_prompt(query, search_results)
         
         t0 = time()
-        ans, token_stats = self.llm(prompt)
+        ans, token_stats = self.llm(prompt, cache_key="rag-answer")
 
-        relevance, rel_token_stats = self.evaluate_relevance(query, ans)
+        if judge:
+            relevance, rel_token_stats = self.evaluate_relevance(query, ans)
+        elif random.random() < self.judge_sample_rate:
+            relevance = {"Relevance": RELEVANCE_PENDING, "Explanation": "Queued for relevance judging"}
+            rel_token_stats = EMPTY_TOKEN_STATS
+        else:
+            relevance = {"Relevance": RELEVANCE_NOT_JUDGED, "Explanation": "Not sampled for relevance judging"}
+            rel_token_stats = EMPTY_TOKEN_STATS
         t1 = time()
         took = t1 - t0
 
@@ -86,6 +198,10 @@ class RAGQueryEngine:
 
         openai_cost = openai_cost_rag + openai_cost_eval
 
+        prompt_tokens_all = token_stats["prompt_tokens"] + rel_token_stats["prompt_tokens"]
+        cached_tokens_all = token_stats["cached_tokens"] + rel_token_stats["cached_tokens"]
+        cache_hit_ratio = cached_tokens_all / prompt_tokens_all if prompt_tokens_all else 0.0
+
         answer_data = {
             "answer": ans,
             "model_used": self.model,
@@ -97,9 +213,12 @@ class RAGQueryEngine:
             "prompt_tokens": token_stats["prompt_tokens"],
             "completion_tokens": token_stats["completion_tokens"],
             "total_tokens": token_stats["total_tokens"],
+            "cached_tokens": token_stats["cached_tokens"],
             "eval_prompt_tokens": rel_token_stats["prompt_tokens"],
             "eval_completion_tokens": rel_token_stats["completion_tokens"],
             "eval_total_tokens": rel_token_stats["total_tokens"],
+            "eval_cached_tokens": rel_token_stats["cached_tokens"],
+            "cache_hit_ratio": cache_hit_ratio,
             "openai_cost": openai_cost,
         }
 
@@ -108,7 +227,7 @@ class RAGQueryEngine:
 
     def evaluate_relevance(self, question, answer):
         prompt = self.evaluation_prompt_template.format(question=question, answer=answer)
-        evaluation, tokens = self.llm(prompt)
+        evaluation, tokens = self.llm(prompt, cache_key="rag-judge")
 
         try:
             json_eval = json.loads(evaluation)
@@ -117,25 +236,83 @@ class RAGQueryEngine:
             result = {"Relevance": "UNKNOWN", "Explanation": "Failed to parse evaluation"}
             return result, tokens
 
-    def calculate_openai_cost(self, tokens):
-        # the below cost is for gpt 5 nano as that is the only model i am using in this project
-        cost = tokens["prompt_tokens"] * 0.00000005 + tokens["completion_tokens"] * 0.0000004
+    def evaluate_relevance_batch(self, items: List[Tuple[str, str]]) -> Tuple[List[Optional[Dict]], Dict]:
+        """Judges several (question, answer) pairs in a single LLM request.
+
+        Returns one evaluation per item, in order, and the token stats of the
+        whole request. Items the response has no valid evaluation for are None,
+        so the caller can retry them instead of recording a bogus verdict.
+        """
+        items_text = "\n\n".join(
+            self.batch_evaluation_item_template.format(id=i, question=question, answer=answer)
+            for i, (question, answer) in enumerate(items, start=1)
+        )
+        prompt = self.batch_evaluation_prompt_template.format(items=items_text)
+        evaluation, tokens = self.llm(
+            prompt, cache_key="rag-judge-batch", response_format=BATCH_EVALUATION_SCHEMA
+        )
+
+        try:
+            entries = json.loads(evaluation or "")["evaluations"]
+        except (json.JSONDecodeError, TypeError, KeyError):
+            return [None] * len(items), tokens
+
+        by_id = {}
+        for entry in entries if isinstance(entries, list) else []:
+            if isinstance(entry, dict) and entry.get("Relevance") in ("NON_RELEVANT", "PARTLY_RELEVANT", "RELEVANT"):
+                try:
+                    by_id[int(entry["id"])] = {
+                        "Relevance": entry["Relevance"],
+                        "Explanation": str(entry.get("Explanation", "")),
+                    }
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+        return [by_id.get(i) for i in range(1, len(items) + 1)], tokens
+
+    def calculate_openai_cost(self, tokens, model: Optional[str] = None):
+        model = model or self.model
+        if model not in MODEL_PRICES:
+            raise ValueError(f"No price configured for model '{model}', add it to MODEL_PRICES")
+        prices = MODEL_PRICES[model]
+
+        cached_tokens = tokens.get("cached_tokens", 0)
+        uncached_tokens = tokens["prompt_tokens"] - cached_tokens
+        cost = (
+            uncached_tokens * prices["input"]
+            + cached_tokens * prices["cached_input"]
+            + tokens["completion_tokens"] * prices["output"]
+        ) / 1_000_000
         return cost
 
-    def llm(self, prompt: str) -> Tuple[str, Dict]:
+    def llm(
+        self, prompt: str, cache_key: Optional[str] = None, response_format: Optional[Dict] = None
+    ) -> Tuple[str, Dict]:
+
+        request = {}
+        if cache_key:
+            # Routes requests sharing a prompt prefix to the same cache
+            request["prompt_cache_key"] = cache_key
+        if response_format:
+            request["response_format"] = response_format
 
         response = self.client.chat.completions.create(
             model=self.model,
             messages=[{"role": "user", "content": prompt}],
+            **request,
         )
 
         answer = response.choices[0].message.content
         usage = response.usage
 
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+
         token_stats = {
             "prompt_tokens": usage.prompt_tokens,
             "completion_tokens": usage.completion_tokens,
             "total_tokens": usage.total_tokens,
+            "cached_tokens": cached_tokens,
         }
 
         return answer, token_stats
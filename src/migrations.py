@@ -0,0 +1,286 @@
+"""Versioned, non-destructive schema migrations for the monitoring database.
+
+Each migration runs once, inside the same transaction that records its version
+in ``schema_migrations``, so a failed migration leaves the schema untouched.
+"""
+from datetime import datetime, timezone
+
+CONVERSATION_COLUMNS = """
+    id TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    model_used TEXT NOT NULL,
+    response_time FLOAT NOT NULL,
+    relevance TEXT NOT NULL,
+    relevance_explanation TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    eval_prompt_tokens INTEGER NOT NULL,
+    eval_completion_tokens INTEGER NOT NULL,
+    eval_total_tokens INTEGER NOT NULL,
+    eval_cached_tokens INTEGER NOT NULL,
+    cache_hit_ratio FLOAT NOT NULL,
+    openai_cost FLOAT NOT NULL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL
+"""
+
+CONVERSATION_COLUMN_NAMES = ", ".join(
+    line.split()[0] for line in CONVERSATION_COLUMNS.strip().splitlines()
+)
+
+
+def month_start(ts: datetime) -> datetime:
+    ts = ts.astimezone(timezone.utc)
+    return datetime(ts.year, ts.month, 1, tzinfo=timezone.utc)
+
+
+def next_month(ts: datetime) -> datetime:
+    if ts.month == 12:
+        return ts.replace(year=ts.year + 1, month=1)
+    return ts.replace(month=ts.month + 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"conversations_p{start.year:04d}_{start.month:02d}"
+
+
+def create_monthly_partition(cur, start: datetime) -> None:
+    """Creates the conversations partition for the month starting at ``start``.
+
+    Rows for that month that already landed in the default partition are moved
+    into the new partition, which Postgres would otherwise refuse to create.
+    """
+    end = next_month(start)
+    name = partition_name(start)
+
+    cur.execute("SELECT to_regclass(%s)", (name,))
+    if cur.fetchone()[0] is not None:
+        return
+
+    cur.execute(
+        "SELECT EXISTS (SELECT 1 FROM conversations_default WHERE timestamp >= %s AND timestamp < %s)",
+        (start, end),
+    )
+    has_stray_rows = cur.fetchone()[0]
+    if has_stray_rows:
+        cur.execute("CREATE TEMP TABLE stray_conversations (LIKE conversations) ON COMMIT DROP")
+        cur.execute(
+            """
+            WITH moved AS (
+                DELETE FROM conversations_default WHERE timestamp >= %s AND timestamp < %s
+                RETURNING *
+            )
+            INSERT INTO stray_conversations SELECT * FROM moved
+            """,
+            (start, end),
+        )
+
+    cur.execute(
+        f"CREATE TABLE {name} PARTITION OF conversations FOR VALUES FROM (%s) TO (%s)",
+        (start, end),
+    )
+
+    if has_stray_rows:
+        cur.execute("INSERT INTO conversations SELECT * FROM stray_conversations")
+        cur.execute("DROP TABLE stray_conversations")
+
+
+def _baseline(cur):
+    """Schema as created by the original init_db, made idempotent."""
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS conversations (
+            {CONVERSATION_COLUMNS},
+            PRIMARY KEY (id)
+        )
+    """)
+    # Databases created before cached-token accounting lack these columns
+    cur.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS cached_tokens INTEGER NOT NULL DEFAULT 0")
+    cur.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS eval_cached_tokens INTEGER NOT NULL DEFAULT 0")
+    cur.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS cache_hit_ratio FLOAT NOT NULL DEFAULT 0")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS feedback (
+            id SERIAL PRIMARY KEY,
+            conversation_id TEXT REFERENCES conversations(id),
+            feedback INTEGER NOT NULL,
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS feedback_timestamp_idx ON feedback (timestamp)")
+
+    # Hourly pre-aggregates that the Grafana dashboards query instead of the raw tables
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_rollup_hourly (
+            bucket TIMESTAMP WITH TIME ZONE PRIMARY KEY,
+            conversations INTEGER NOT NULL,
+            avg_response_time FLOAT NOT NULL,
+            p50_response_time FLOAT NOT NULL,
+            p90_response_time FLOAT NOT NULL,
+            p99_response_time FLOAT NOT NULL,
+            max_response_time FLOAT NOT NULL,
+            prompt_tokens BIGINT NOT NULL,
+            completion_tokens BIGINT NOT NULL,
+            total_tokens BIGINT NOT NULL,
+            cached_tokens BIGINT NOT NULL,
+            eval_prompt_tokens BIGINT NOT NULL,
+            eval_completion_tokens BIGINT NOT NULL,
+            eval_total_tokens BIGINT NOT NULL,
+            eval_cached_tokens BIGINT NOT NULL,
+            openai_cost FLOAT NOT NULL,
+            relevant INTEGER NOT NULL,
+            partly_relevant INTEGER NOT NULL,
+            non_relevant INTEGER NOT NULL,
+            unknown_relevance INTEGER NOT NULL
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS feedback_rollup_hourly (
+            bucket TIMESTAMP WITH TIME ZONE PRIMARY KEY,
+            thumbs_up INTEGER NOT NULL,
+            thumbs_down INTEGER NOT NULL
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name TEXT PRIMARY KEY,
+            watermark TIMESTAMP WITH TIME ZONE NOT NULL
+        )
+    """)
+
+
+def _partition_conversations(cur):
+    """Moves conversations into a table range-partitioned by month.
+
+    The primary key of a partitioned table must include the partition key, so it
+    becomes (id, timestamp) and feedback can no longer hold a foreign key to
+    conversations(id); feedback.conversation_id is indexed instead.
+    """
+    cur.execute("ALTER TABLE feedback DROP CONSTRAINT IF EXISTS feedback_conversation_id_fkey")
+    cur.execute("ALTER TABLE conversations RENAME TO conversations_legacy")
+    cur.execute("ALTER TABLE conversations_legacy RENAME CONSTRAINT conversations_pkey TO conversations_legacy_pkey")
+    cur.execute("DROP INDEX IF EXISTS conversations_timestamp_idx")
+
+    cur.execute(f"""
+        CREATE TABLE conversations (
+            {CONVERSATION_COLUMNS},
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+    cur.execute("CREATE TABLE conversations_default PARTITION OF conversations DEFAULT")
+
+    cur.execute("SELECT MIN(timestamp), now() FROM conversations_legacy")
+    oldest, now = cur.fetchone()
+    start = month_start(oldest or now)
+    end = next_month(next_month(month_start(now)))
+    while start <= end:
+        create_monthly_partition(cur, start)
+        start = next_month(start)
+
+    cur.execute(f"""
+        INSERT INTO conversations ({CONVERSATION_COLUMN_NAMES})
+        SELECT {CONVERSATION_COLUMN_NAMES} FROM conversations_legacy
+    """)
+    cur.execute("DROP TABLE conversations_legacy")
+
+    # Indexes are built after the bulk copy; on the parent they cascade to every partition
+    cur.execute("CREATE INDEX conversations_timestamp_idx ON conversations (timestamp DESC)")
+    cur.execute("CREATE INDEX conversations_relevance_timestamp_idx ON conversations (relevance, timestamp DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS feedback_conversation_id_idx ON feedback (conversation_id)")
+
+
+def _sampled_judging(cur):
+    """Supports sampled, batched relevance judging.
+
+    Conversations waiting for the batch judge have relevance 'PENDING'; the
+    partial index keeps finding them cheap however large the table grows.
+    Answers judged only because of negative feedback are flagged, so they can
+    be kept out of the sampled relevance statistics.
+    """
+    cur.execute("ALTER TABLE conversations ADD COLUMN judged_for_feedback BOOLEAN NOT NULL DEFAULT FALSE")
+    cur.execute("""
+        CREATE INDEX conversations_pending_judgement_idx ON conversations (timestamp)
+        WHERE relevance = 'PENDING'
+    """)
+    cur.execute("ALTER TABLE conversation_rollup_hourly ADD COLUMN pending_relevance INTEGER NOT NULL DEFAULT 0")
+    cur.execute("ALTER TABLE conversation_rollup_hourly ADD COLUMN not_judged INTEGER NOT NULL DEFAULT 0")
+    cur.execute("ALTER TABLE conversation_rollup_hourly ADD COLUMN feedback_judged INTEGER NOT NULL DEFAULT 0")
+
+
+def _judge_leases(cur):
+    """Lets judge workers claim conversations without holding row locks.
+
+    A worker moves claimed rows from 'PENDING' to 'JUDGING' with a lease;
+    rows whose lease expired (e.g. the worker died) can be claimed again.
+    ``judge_attempts`` counts responses that had no valid evaluation for a row.
+    """
+    cur.execute("ALTER TABLE conversations ADD COLUMN judge_lease_until TIMESTAMP WITH TIME ZONE")
+    cur.execute("ALTER TABLE conversations ADD COLUMN judge_attempts INTEGER NOT NULL DEFAULT 0")
+    cur.execute("DROP INDEX IF EXISTS conversations_pending_judgement_idx")
+    cur.execute("""
+        CREATE INDEX conversations_judge_queue_idx ON conversations (timestamp)
+        WHERE relevance IN ('PENDING', 'JUDGING')
+    """)
+
+
+def _rollup_dirty_buckets(cur):
+    """Hours whose conversations changed long after they were inserted.
+
+    Relevance judging and feedback can update a conversation days later,
+    outside the window refresh_rollups re-aggregates on every run; such
+    updates record the conversation's hour here so it is re-aggregated too.
+    """
+    cur.execute("""
+        CREATE TABLE rollup_dirty_buckets (
+            bucket TIMESTAMP WITH TIME ZONE PRIMARY KEY
+        )
+    """)
+
+
+MIGRATIONS = [
+    (1, "baseline schema", _baseline),
+    (2, "monthly partitions and indexes for conversations", _partition_conversations),
+    (3, "sampled relevance judging", _sampled_judging),
+    (4, "leases for relevance judge workers", _judge_leases),
+    (5, "dirty buckets for the hourly rollups", _rollup_dirty_buckets),
+]
+
+
+def migrate(conn) -> list:
+    """Applies pending migrations in order and returns the versions applied."""
+    applied = []
+    with conn.cursor() as cur:
+        # Concurrent migrators wait here instead of racing on DDL
+        cur.execute("SELECT pg_advisory_lock(hashtext('schema_migrations'))")
+        try:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+                )
+            """)
+            conn.commit()
+
+            cur.execute("SELECT version FROM schema_migrations")
+            done = {row[0] for row in cur.fetchall()}
+
+            for version, description, apply in MIGRATIONS:
+                if version in done:
+                    continue
+                print(f"Applying migration {version}: {description}")
+                try:
+                    apply(cur)
+                    cur.execute(
+                        "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                        (version, description),
+                    )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                applied.append(version)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(hashtext('schema_migrations'))")
+            conn.commit()
+    return applied
@@ -1,9 +1,22 @@
-from typing import Optional
+import threading
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
 from llm_utility import RAGQueryEngine
 
 # Cached instance - created once and reused
 _rag_engine: Optional[RAGQueryEngine] = None
 
+# Identical questions being answered right now, keyed by question and location
+_inflight: Dict[Tuple, Future] = {}
+_inflight_lock = threading.Lock()
+
+# Usage fields zeroed for coalesced requests, so monitoring counts each LLM call once
+_USAGE_FIELDS = (
+    "prompt_tokens", "completion_tokens", "total_tokens", "cached_tokens",
+    "eval_prompt_tokens", "eval_completion_tokens", "eval_total_tokens", "eval_cached_tokens",
+    "openai_cost",
+)
+
 def _get_or_create_rag_engine() -> RAGQueryEngine:
     """Get or create cached instance of RAGQueryEngine."""
     global _rag_engine
@@ -13,11 +26,63 @@ def _get_or_create_rag_engine() -> RAGQueryEngine:
     
     return _rag_engine
 
-def rag_llm(question: str) -> str:
-    """Process a question using the RAG pipeline."""
+def warmup() -> None:
+    """Builds the RAG engine, loads the embedding model and the ZIP centroids ahead of the first request."""
+    rag_engine = _get_or_create_rag_engine()
+    rag_engine.retrieval_index.embedding.warmup()
+    rag_engine.retrieval_index.zip_centroids()
+
+def reconnect() -> None:
+    """Re-creates network clients after fork; the loaded model and engine are kept."""
+    if _rag_engine is not None:
+        _rag_engine.reconnect()
+
+def rag_llm(
+    question: str,
+    center: Optional[Tuple[float, float]] = None,
+    radius_km: Optional[float] = None,
+    zip_code: Optional[str] = None,
+) -> str:
+    """Process a question using the RAG pipeline.
+
+    If a ``center`` (lat, lng) or ``zip_code`` is given, only restaurants within
+    ``radius_km`` of it are retrieved. Identical questions arriving while one is
+    already being answered wait for that answer instead of running the pipeline
+    again.
+    """
+    key = (" ".join(question.split()), center, radius_km, zip_code)
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _inflight[key] = future
+
+    if not is_leader:
+        answer_data = dict(future.result())
+        for field in _USAGE_FIELDS:
+            answer_data[field] = 0
+        return answer_data
+
+    try:
+        answer_data = _run_pipeline(question, center, radius_km, zip_code)
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(answer_data)
+        return answer_data
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+def _run_pipeline(question, center, radius_km, zip_code):
     rag_engine = _get_or_create_rag_engine()
     
-    results = rag_engine.retrieval_index.search(question, num_results=5)
+    results = rag_engine.retrieval_index.search(
+        question, num_results=5, center=center, radius_km=radius_km, zip_code=zip_code
+    )
 
     res = []
     for point in results.points:
@@ -0,0 +1,27 @@
+import os
+import time
+import argparse
+from dotenv import load_dotenv
+
+os.environ['RUN_TIMEZONE_CHECK'] = '0'
+
+from db import refresh_rollups
+
+load_dotenv()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Refresh the hourly monitoring rollups used by the Grafana dashboards"
+    )
+    parser.add_argument(
+        "--interval", type=int, default=0,
+        help="Keep refreshing every N seconds instead of running once"
+    )
+    args = parser.parse_args()
+
+    while True:
+        watermark = refresh_rollups()
+        print(f"Rollups refreshed up to {watermark}")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
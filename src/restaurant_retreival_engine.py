@@ -1,31 +1,201 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple, Callable
+from concurrent.futures import Future
 from qdrant_client import QdrantClient, models
+# models.QueryResponse is shadowed by fastembed's result type, this is the query_points response
+from qdrant_client.http.models import QueryResponse
 from fastembed import TextEmbedding
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import hashlib
+import json
 import os
 import math
 import tqdm.auto as tqdm_auto
 import threading
+import queue
 import time
 
 
+class QueryEmbeddingBatcher:
+    """Micro-batches concurrent query embeddings into single model calls.
+
+    Callers submit a text and block on a future. A dispatcher thread takes the
+    first queued text, waits up to ``max_wait_ms`` for more (or until
+    ``max_batch_size``), embeds them in one call and resolves every future.
+    Identical texts already in flight share one future instead of being
+    embedded again.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        max_wait_ms: float = 2.0,
+        max_batch_size: int = 32,
+    ):
+        self.embed_batch = embed_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._inflight: Dict[str, Future] = {}
+
+    def _ensure_dispatcher(self) -> None:
+        # Threads don't survive fork, so each process starts its own dispatcher
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._inflight = {}
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, text: str) -> Future:
+        with self._lock:
+            self._ensure_dispatcher()
+            future = self._inflight.get(text)
+            if future is not None:
+                return future
+            future = Future()
+            self._inflight[text] = future
+            self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    def _collect_batch(self) -> List[Tuple[str, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Window closed; still take anything that is already queued
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self.embed_batch(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            finally:
+                # Texts submitted during the model call joined these futures
+                with self._lock:
+                    for text in texts:
+                        self._inflight.pop(text, None)
+
+
 class EmbeddingService:
     """Handles local embedding generation using FastEmbed."""
 
-    def __init__(self, model_name: str = "jinaai/jina-embeddings-v2-small-en"):
+    def __init__(
+        self,
+        model_name: str = "jinaai/jina-embeddings-v2-small-en",
+        threads: Optional[int] = None,
+        batch_window_ms: Optional[float] = None,
+        max_batch_size: int = 32,
+    ):
         self.model_name = model_name
+        # ONNX Runtime intra-op threads; None lets it use every core
+        self.threads = threads
+        self._model: Optional[TextEmbedding] = None
+        # With a batch window, concurrent embed_query calls share model calls
+        self._batcher: Optional[QueryEmbeddingBatcher] = None
+        if batch_window_ms is not None:
+            self._batcher = QueryEmbeddingBatcher(self._embed_queries, batch_window_ms, max_batch_size)
+
+    @property
+    def model(self) -> TextEmbedding:
+        if self._model is None:
+            self._model = TextEmbedding(model_name=self.model_name, threads=self.threads)
+        return self._model
+
+    def warmup(self) -> None:
+        """Loads the model and runs one inference, so the first request doesn't pay for it."""
+        # Bypasses the batcher so no dispatcher thread is started before a fork
+        self._embed_queries(["warmup"])
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return " ".join(text.split())  # normalize whitespace
 
     def embed_text(self, text: str) -> models.Document:
-        text = " ".join(text.split())  # normalize whitespace
-        return models.Document(text=text, model=self.model_name)
+        return models.Document(text=self._normalize(text), model=self.model_name)
+
+    def embed_documents(self, texts: List[str], batch_size: int = 256) -> List[List[float]]:
+        """Embeds texts locally in batches, returning one vector per text."""
+        texts = [self._normalize(text) for text in texts]
+        return [vector.tolist() for vector in self.model.embed(texts, batch_size=batch_size)]
+
+    def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return [vector.tolist() for vector in self.model.query_embed(texts)]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embeds a search query locally, so one vector can serve several Qdrant requests."""
+        text = self._normalize(text)
+        if self._batcher is not None:
+            return self._batcher.embed(text)
+        return self._embed_queries([text])[0]
 
 
 class DataLoader:
-    """Responsible for loading and preparing restaurant data."""
+    """Responsible for loading and preparing restaurant data.
+
+    The cleaned, merged dataset is written once to a typed Parquet snapshot next
+    to the source CSVs. Later loads memory-map the snapshot instead of re-parsing
+    and re-merging the CSVs, and the snapshot is rebuilt whenever the content
+    hash of a source file changes.
+    """
+
+    SNAPSHOT_FORMAT_VERSION = 1
+    SNAPSHOT_METADATA_KEY = b"restaurant_rag"
 
-    def __init__(self, restaurants_path: str, menu_path: str):
+    RESTAURANT_DTYPES = {
+        "id": "int64",
+        "position": "Int64",
+        "name": "string",
+        "score": "float64",
+        "ratings": "float64",
+        "category": "string",
+        "price_range": "string",
+        "full_address": "string",
+        "zip_code": "string",
+        "lat": "float64",
+        "lng": "float64",
+    }
+    MENU_DTYPES = {
+        "restaurant_id": "int64",
+        "category": "string",
+        "name": "string",
+        "description": "string",
+        "price": "string",
+    }
+
+    def __init__(
+        self,
+        restaurants_path: str,
+        menu_path: str,
+        snapshot_path: Optional[str] = None,
+        menu_nrows: Optional[int] = 100000,
+    ):
         self.restaurants_path = restaurants_path
         self.menu_path = menu_path
+        self.snapshot_path = snapshot_path or os.path.join(
+            os.path.dirname(restaurants_path), "restaurants-merged.parquet"
+        )
+        self.menu_nrows = menu_nrows
 
     @staticmethod
     def _safe_value(val: Any) -> str:
@@ -35,16 +205,27 @@ class DataLoader:
             return "Not available"
         return str(val)
 
-    def load_and_merge_data(self) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _file_sha256(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _check_sources(self) -> None:
         if not os.path.exists(self.restaurants_path):
             raise FileNotFoundError(f"File not found: {self.restaurants_path}")
         if not os.path.exists(self.menu_path):
             raise FileNotFoundError(f"File not found: {self.menu_path}")
 
-        df_rest = pd.read_csv(self.restaurants_path)
+    def _read_and_merge_csv(self) -> pd.DataFrame:
+        self._check_sources()
+
+        df_rest = pd.read_csv(self.restaurants_path, dtype=self.RESTAURANT_DTYPES)
         df_rest.drop_duplicates(subset=["name"], inplace=True)
 
-        df_menu = pd.read_csv(self.menu_path, nrows=100000)
+        df_menu = pd.read_csv(self.menu_path, dtype=self.MENU_DTYPES, nrows=self.menu_nrows)
         df_menu.drop_duplicates(inplace=True)
 
         df = pd.merge(
@@ -56,8 +237,182 @@ class DataLoader:
         df[["city", "state"]] = df["full_address"].str.extract(
             r",\s*([^,]+?)\s*,\s*([A-Z]{2})\b"
         )
+        return df
+
+    def _source_fingerprint(self, previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Size, mtime and SHA-256 of each source file.
+
+        Hashing a multi-GB CSV takes a while, so when size and mtime still match
+        the ``previous`` fingerprint its hash is reused.
+        """
+        previous = previous or {}
+        sources = {}
+        for key, path in (("restaurants", self.restaurants_path), ("menus", self.menu_path)):
+            stat = os.stat(path)
+            known = previous.get("sources", {}).get(key, {})
+            if known.get("size") == stat.st_size and known.get("mtime_ns") == stat.st_mtime_ns:
+                sha256 = known["sha256"]
+            else:
+                sha256 = self._file_sha256(path)
+            sources[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+
+        dataset_hash = hashlib.sha256(json.dumps({
+            "format_version": self.SNAPSHOT_FORMAT_VERSION,
+            "restaurants": sources["restaurants"]["sha256"],
+            "menus": sources["menus"]["sha256"],
+            "menu_nrows": self.menu_nrows,
+        }, sort_keys=True).encode()).hexdigest()
+
+        return {"sources": sources, "dataset_hash": dataset_hash}
+
+    def _read_snapshot_metadata(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            metadata = pq.read_schema(self.snapshot_path).metadata or {}
+        except (pa.ArrowInvalid, OSError):
+            return None
+        raw = metadata.get(self.SNAPSHOT_METADATA_KEY)
+        return json.loads(raw) if raw else None
+
+    def build_snapshot(self, fingerprint: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Parses, cleans and merges the CSVs and writes the Parquet snapshot."""
+        self._check_sources()
+        fingerprint = fingerprint or self._source_fingerprint()
+
+        print(f"Building dataset snapshot '{self.snapshot_path}'...")
+        df = self._read_and_merge_csv()
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            self.SNAPSHOT_METADATA_KEY: json.dumps(fingerprint).encode(),
+        })
+
+        # Write next to the target and rename, so readers never see a partial file
+        tmp_path = f"{self.snapshot_path}.tmp"
+        pq.write_table(table, tmp_path, row_group_size=50_000, compression="zstd")
+        os.replace(tmp_path, self.snapshot_path)
+
+        print(f"✅ Snapshot written with {table.num_rows} rows")
+        return fingerprint
+
+    def ensure_snapshot(self) -> Dict[str, Any]:
+        """Returns the snapshot metadata, rebuilding the snapshot if it is stale."""
+        self._check_sources()
+        existing = self._read_snapshot_metadata()
+        fingerprint = self._source_fingerprint(existing)
+
+        if existing and existing.get("dataset_hash") == fingerprint["dataset_hash"]:
+            return existing
+
+        if existing:
+            print("Source data changed since the last snapshot. Rebuilding...")
+        return self.build_snapshot(fingerprint)
+
+    def dataset_hash(self) -> str:
+        return self.ensure_snapshot()["dataset_hash"]
+
+    def source_dataset_hash(self) -> Optional[str]:
+        """Dataset hash of the current source CSVs, or None if they are missing.
+
+        Never builds a snapshot; the CSVs are only re-hashed if their size or
+        mtime changed since the snapshot was written.
+        """
+        try:
+            self._check_sources()
+        except FileNotFoundError:
+            return None
+        return self._source_fingerprint(self._read_snapshot_metadata())["dataset_hash"]
+
+    def load_table(self, columns: Optional[List[str]] = None) -> pa.Table:
+        """Memory-maps the snapshot, reading only the requested ``columns``."""
+        self.ensure_snapshot()
+        return pq.read_table(self.snapshot_path, columns=columns, memory_map=True)
+
+    def iter_batches(
+        self, columns: Optional[List[str]] = None, batch_size: int = 10_000
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Streams the snapshot as lists of records, one row-group slice at a time."""
+        self.ensure_snapshot()
+        parquet_file = pq.ParquetFile(self.snapshot_path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pylist()
+
+    def load_and_merge_data(self) -> List[Dict[str, Any]]:
+        # Missing values come back as None, like iter_batches, rather than pandas' pd.NA
+        return self.load_table().to_pylist()
+
+    @staticmethod
+    def normalize_zip(zip_code: Any) -> Optional[str]:
+        if zip_code is None or (isinstance(zip_code, float) and math.isnan(zip_code)):
+            return None
+        zip_code = str(zip_code).strip()
+        if zip_code.endswith(".0"):
+            zip_code = zip_code[:-2]
+        # Keep the 5-digit ZIP of ZIP+4 codes
+        return zip_code.split("-")[0].zfill(5) if zip_code else None
+
+    @staticmethod
+    def geo_point(record: Dict[str, Any]) -> Optional[Dict[str, float]]:
+        """Qdrant geo payload for a record, or None if it has no valid coordinates."""
+        lat, lng = record.get("lat"), record.get("lng")
+        if lat is None or lng is None:
+            return None
+        lat, lng = float(lat), float(lng)
+        if math.isnan(lat) or math.isnan(lng) or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            return None
+        return {"lat": lat, "lon": lng}
+
+    RESTAURANT_FIELDS = [
+        "restaurant_id", "name_x", "score", "ratings", "category_x", "price_range",
+        "full_address", "zip_code", "lat", "lng", "city", "state",
+    ]
+
+    def restaurant_records(
+        self, data: Iterable[Dict[str, Any]], max_menu_categories: int = 20, max_menu_items: int = 30
+    ) -> List[Dict[str, Any]]:
+        """One record per restaurant, with a sample of its menu categories and items."""
+        restaurants: Dict[Any, Dict[str, Any]] = {}
+        for record in data:
+            restaurant = restaurants.get(record["restaurant_id"])
+            if restaurant is None:
+                restaurant = {field: record.get(field) for field in self.RESTAURANT_FIELDS}
+                restaurant["menu_categories"] = []
+                restaurant["menu_items"] = []
+                restaurants[record["restaurant_id"]] = restaurant
+
+            category, item = record.get("category_y"), record.get("name_y")
+            if category and category not in restaurant["menu_categories"] \
+                    and len(restaurant["menu_categories"]) < max_menu_categories:
+                restaurant["menu_categories"].append(category)
+            if item and item not in restaurant["menu_items"] \
+                    and len(restaurant["menu_items"]) < max_menu_items:
+                restaurant["menu_items"].append(item)
+        return list(restaurants.values())
+
+    def format_restaurant_text(self, record: Dict[str, Any]) -> str:
+        return (
+            f"{self.format_location_text(record)} "
+            f"Menu categories: {', '.join(record.get('menu_categories') or []) or 'Not available'}. "
+            f"Menu items: {', '.join(record.get('menu_items') or []) or 'Not available'}."
+        )
 
-        return df.to_dict(orient="records")
+    def format_item_text(self, record: Dict[str, Any]) -> str:
+        """Location-independent part of a menu-item row, identical across a chain's locations."""
+        sv = self._safe_value
+        return (
+            f"Menu item: {sv(record.get('name_y'))} - {sv(record.get('category_y'))}. "
+            f"Description: {sv(record.get('description'))}."
+        )
+
+    def format_location_text(self, record: Dict[str, Any]) -> str:
+        """Location-specific part of a menu-item row; searched via the restaurant collection."""
+        sv = self._safe_value
+        return (
+            f"{sv(record.get('name_x'))} - {sv(record.get('category_x'))} - {sv(record.get('full_address'))}. "
+            f"Price Range: {sv(record.get('price_range'))}. "
+            f"Ratings: {sv(record.get('ratings'))}."
+        )
 
     def format_embedding_text(self, record: Dict[str, Any]) -> str:
         sv = self._safe_value
@@ -73,10 +428,24 @@ class DataLoader:
 class RestaurantVectorStore:
     """Encapsulates Qdrant client operations: collection management and indexing."""
 
-    def __init__(self, host: str = "http://localhost:6333", batch_size: int = 500):
-        self.client = QdrantClient(host)
+    SNAPSHOT_FORMAT_VERSION = 1
+    SNAPSHOT_METADATA_KEY = b"restaurant_rag_index"
+
+    def __init__(self, host: Optional[str] = None, batch_size: int = 500, path: Optional[str] = None):
+        """Connects to a Qdrant server at ``host``, or to the embedded backend stored at ``path``."""
+        self.host = host or os.getenv("QDRANT_HOST", "http://localhost:6333")
+        self.path = path
+        self.client = self._create_client()
         self.batch_size = batch_size
 
+    def _create_client(self) -> QdrantClient:
+        if self.path:
+            return QdrantClient(path=self.path)
+        return QdrantClient(self.host)
+
+    def reconnect(self) -> None:
+        """Replaces the client, e.g. in a forked worker that must not share the parent's sockets."""
+        self.client = self._create_client()
 
     def create_collection(self, name: str, vector_size: int = 512) -> None:
         if self.client.collection_exists(collection_name=name):
@@ -91,73 +460,494 @@ class RestaurantVectorStore:
                 distance=models.Distance.COSINE
             )
         )
-    def _batch_upsert(self, name: str, points):
-        total = len(points)
-        with tqdm_auto.tqdm(total=total, desc=f"Indexing → {name}", unit="pts") as pbar:
-            for i in range(0, total, self.batch_size):
-                batch = points[i : i + self.batch_size]
-                self.client.upsert(collection_name=name, points=batch)
-                pbar.update(len(batch))
-                time.sleep(0.05)  # prevents UI from freezing with large batches
+
+    def create_payload_index(self, name: str, field_name: str, field_schema: models.PayloadSchemaType) -> None:
+        self.client.create_payload_index(
+            collection_name=name,
+            field_name=field_name,
+            field_schema=field_schema,
+        )
+
+    def _batch_upsert(self, name: str, batches: Iterable[List[models.PointStruct]]):
+        """Upserts points arriving as an iterable of lists, pulling the next list only once the previous one is stored."""
+        total = 0
+        with tqdm_auto.tqdm(desc=f"Indexing → {name}", unit="pts") as pbar:
+            for points in batches:
+                for i in range(0, len(points), self.batch_size):
+                    batch = points[i : i + self.batch_size]
+                    self.client.upsert(collection_name=name, points=batch)
+                    pbar.update(len(batch))
+                    total += len(batch)
+                    time.sleep(0.05)  # prevents UI from freezing with large batches
 
         print(f"✅ Finished upserting {total} points into '{name}'")
     
-    def upsert_points_async(self, name: str, points):
-        worker = threading.Thread(
-            target=self._batch_upsert,
-            args=(name, points),
-            daemon=True
+    def export_snapshot(self, name: str, path: str, embedding_model: str, dataset_hash: Optional[str] = None) -> Dict[str, Any]:
+        """Writes a collection's vectors, payloads and config to a single Parquet file.
+
+        The file header records the vector config, payload indexes, embedding
+        model and dataset hash, so a restore can check compatibility first.
+        """
+        info = self.client.get_collection(collection_name=name)
+        vectors_config = info.config.params.vectors
+        header = {
+            "format_version": self.SNAPSHOT_FORMAT_VERSION,
+            "collection": name,
+            "vector_size": vectors_config.size,
+            "distance": vectors_config.distance.value,
+            "payload_indexes": {
+                field: schema.data_type.value for field, schema in (info.payload_schema or {}).items()
+            },
+            "embedding_model": embedding_model,
+            "dataset_hash": dataset_hash,
+            "points_count": info.points_count,
+        }
+        schema = pa.schema(
+            [
+                ("id", pa.string()),
+                ("vector", pa.list_(pa.float32(), vectors_config.size)),
+                ("payload", pa.string()),
+            ],
+            metadata={self.SNAPSHOT_METADATA_KEY: json.dumps(header).encode()},
+        )
+
+        tmp_path = f"{path}.tmp"
+        offset = None
+        with tqdm_auto.tqdm(total=info.points_count, desc=f"Exporting {name}", unit="pts") as pbar:
+            with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+                while True:
+                    points, offset = self.client.scroll(
+                        collection_name=name,
+                        limit=self.batch_size,
+                        offset=offset,
+                        with_payload=True,
+                        with_vectors=True,
+                    )
+                    if points:
+                        writer.write_table(pa.table({
+                            "id": [str(point.id) for point in points],
+                            "vector": [point.vector for point in points],
+                            "payload": [json.dumps(point.payload) for point in points],
+                        }, schema=schema))
+                        pbar.update(len(points))
+                    if offset is None:
+                        break
+        os.replace(tmp_path, path)
+
+        print(f"✅ Exported {info.points_count} points from '{name}' to '{path}'")
+        return header
+
+    @classmethod
+    def read_snapshot_header(cls, path: str) -> Dict[str, Any]:
+        metadata = pq.read_schema(path).metadata or {}
+        if cls.SNAPSHOT_METADATA_KEY not in metadata:
+            raise ValueError(f"'{path}' is not an index snapshot")
+        header = json.loads(metadata[cls.SNAPSHOT_METADATA_KEY])
+        if header["format_version"] != cls.SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format version {header['format_version']}")
+        return header
+
+    @staticmethod
+    def _parse_point_id(point_id: str):
+        return int(point_id) if point_id.isdigit() else point_id
+
+    def restore_snapshot(
+        self, path: str, embedding_model: str, name: Optional[str] = None, force: bool = False
+    ) -> Dict[str, Any]:
+        """Bulk-loads a snapshot written by export_snapshot into a collection.
+
+        Refuses to load if the snapshot was built with a different embedding
+        model, if an existing collection has an incompatible vector config, or
+        if it already holds points (unless ``force``).
+        """
+        header = self.read_snapshot_header(path)
+        name = name or header["collection"]
+        if header["embedding_model"] != embedding_model:
+            raise ValueError(
+                f"Snapshot was built with '{header['embedding_model']}', "
+                f"but the search engine uses '{embedding_model}'"
+            )
+
+        distance = models.Distance(header["distance"])
+        if self.client.collection_exists(collection_name=name):
+            info = self.client.get_collection(collection_name=name)
+            vectors_config = info.config.params.vectors
+            if vectors_config.size != header["vector_size"] or vectors_config.distance != distance:
+                raise ValueError(f"Collection '{name}' has an incompatible vector config")
+            if info.points_count and not force:
+                raise ValueError(f"Collection '{name}' is not empty, use force to load into it anyway")
+        else:
+            # No HNSW indexing during the bulk load; it is built once at the end
+            self.client.create_collection(
+                collection_name=name,
+                vectors_config=models.VectorParams(size=header["vector_size"], distance=distance),
+                optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0),
+            )
+
+        for field, data_type in header["payload_indexes"].items():
+            self.create_payload_index(name, field, models.PayloadSchemaType(data_type))
+
+        def points():
+            parquet_file = pq.ParquetFile(path, memory_map=True)
+            for batch in parquet_file.iter_batches(batch_size=self.batch_size):
+                columns = batch.to_pydict()
+                for point_id, vector, payload in zip(columns["id"], columns["vector"], columns["payload"]):
+                    yield models.PointStruct(
+                        id=self._parse_point_id(point_id), vector=vector, payload=json.loads(payload)
+                    )
+
+        with tqdm_auto.tqdm(total=header["points_count"], desc=f"Restoring → {name}", unit="pts") as pbar:
+            def counted():
+                for point in points():
+                    pbar.update(1)
+                    yield point
+
+            self.client.upload_points(
+                collection_name=name, points=counted(), batch_size=self.batch_size, wait=True
+            )
+
+        self.client.update_collection(
+            collection_name=name,
+            optimizers_config=models.OptimizersConfigDiff(indexing_threshold=20000),
         )
+        print(f"✅ Restored {header['points_count']} points into '{name}'")
+        return header
+
+    def upsert_points_async(self, name: str, points):
+        return self.upsert_collections_async([(name, [points])])
+
+    def upsert_collections_async(self, streams: List[Tuple[str, Iterable[List[models.PointStruct]]]]):
+        """Upserts several collections one after another on a background thread.
+
+        Each collection's points come as an iterable of batches that is consumed
+        on the thread, so a generator never has to hold all points in memory.
+        """
+        def run():
+            for name, batches in streams:
+                self._batch_upsert(name, batches)
+
+        worker = threading.Thread(target=run, daemon=True)
         worker.start()
         return worker  # so caller can optionally `.join()`
 
 
+class UnknownZipCodeError(ValueError):
+    """Raised for a ZIP code that no indexed restaurant is located in."""
+
+
 class RestaurantSearchEngine:
     """High-level interface for indexing and searching restaurant data."""
 
+    GEO_FIELD = "location"
+    DEFAULT_RADIUS_KM = 10.0
+
     def __init__(
         self,
         vector_store: RestaurantVectorStore,
         embedding_service: EmbeddingService,
         data_loader: DataLoader,
-        default_collection: str = "restaurants"
+        default_collection: str = "restaurants",
+        hierarchical: bool = False,
     ):
         self.vector_store = vector_store
         self.embedding = embedding_service
         self.data_loader = data_loader
         self.default_collection = default_collection
+        # Two-stage search: restaurants first, then menu items of those restaurants
+        self.hierarchical = hierarchical
+        self._zip_centroids: Dict[str, Dict[str, Tuple[float, float]]] = {}
+
+    @staticmethod
+    def restaurant_collection_for(collection_name: str) -> str:
+        """Name of the restaurant-level collection paired with a menu-item collection."""
+        return f"{collection_name}_restaurants"
 
     def initialize_collection(self, collection_name: Optional[str] = None) -> None:
         coll = collection_name or self.default_collection
         self.vector_store.create_collection(name=coll)
+        self.vector_store.create_payload_index(coll, self.GEO_FIELD, models.PayloadSchemaType.GEO)
+        self.vector_store.create_payload_index(coll, "restaurant_id", models.PayloadSchemaType.INTEGER)
+
+        restaurant_coll = self.restaurant_collection_for(coll)
+        self.vector_store.create_collection(name=restaurant_coll)
+        self.vector_store.create_payload_index(restaurant_coll, self.GEO_FIELD, models.PayloadSchemaType.GEO)
+
+    def _payload(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        payload = dict(record)
+        geo = self.data_loader.geo_point(record)
+        if geo is not None:
+            payload[self.GEO_FIELD] = geo
+        return payload
+
+    def _record_batches(
+        self, data: Optional[List[Dict[str, Any]]], batch_size: int, columns: Optional[List[str]] = None
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Slices of ``data`` if given, otherwise batches streamed from the dataset snapshot."""
+        if data is None:
+            yield from self.data_loader.iter_batches(columns=columns, batch_size=batch_size)
+            return
+        for i in range(0, len(data), batch_size):
+            yield data[i : i + batch_size]
+
+    @staticmethod
+    def _text_key(text: str) -> bytes:
+        # A short digest keeps the dedup map small for millions of distinct texts
+        return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+    def _item_point_batches(
+        self, coll: str, data: Optional[List[Dict[str, Any]]], dedupe: bool, batch_size: int
+    ) -> Iterator[List[models.PointStruct]]:
+        """Menu-item points, one batch of rows at a time.
+
+        With ``dedupe`` each distinct location-independent item text is embedded
+        once: rows of chain restaurants share item name, category and
+        description, and the location lives in the payload and the restaurant
+        collection. The dedup map keeps the id of the first point embedded from
+        each text, and a text seen in an earlier batch reuses that point's
+        stored vector. Only one batch of vectors is held in memory at a time.
+        """
+        first_point_ids: Dict[bytes, int] = {}
+        idx = 0
+        for batch in self._record_batches(data, batch_size):
+            if not dedupe:
+                vectors = [
+                    self.embedding.embed_text(self.data_loader.format_embedding_text(record))
+                    for record in batch
+                ]
+            else:
+                texts = [self.data_loader.format_item_text(record) for record in batch]
+                keys = [self._text_key(text) for text in texts]
+
+                new_texts: Dict[bytes, str] = {}
+                for key, text in zip(keys, texts):
+                    if key not in first_point_ids and key not in new_texts:
+                        new_texts[key] = text
+                by_key = dict(zip(new_texts, self.embedding.embed_documents(list(new_texts.values()))))
+
+                # Batches are upserted before the next one is built, so earlier vectors can be read back
+                reused_ids = list({first_point_ids[key] for key in keys if key not in by_key})
+                stored = {}
+                if reused_ids:
+                    stored = {
+                        point.id: point.vector
+                        for point in self.vector_store.client.retrieve(
+                            collection_name=coll, ids=reused_ids, with_vectors=True
+                        )
+                    }
 
-    def index_data(self, collection_name: Optional[str] = None , data: Optional[List[Dict[str, Any]]] = None) -> None:
+                vectors = []
+                for offset, key in enumerate(keys):
+                    if key in by_key:
+                        first_point_ids.setdefault(key, idx + offset)
+                        vectors.append(by_key[key])
+                    else:
+                        vectors.append(stored[first_point_ids[key]])
+
+            yield [
+                models.PointStruct(id=idx + offset, vector=vector, payload=self._payload(record))
+                for offset, (record, vector) in enumerate(zip(batch, vectors))
+            ]
+            idx += len(batch)
+
+        if dedupe:
+            ratio = idx / len(first_point_ids) if first_point_ids else 1.0
+            print(
+                f"Embedded {len(first_point_ids)} unique item texts for {idx} rows "
+                f"(dedup ratio {ratio:.2f}x)."
+            )
+
+    def _restaurant_point_batches(
+        self, data: Optional[List[Dict[str, Any]]], batch_size: int
+    ) -> Iterator[List[models.PointStruct]]:
+        """Restaurant-level points, built from one pass over the rows and embedded a batch at a time."""
+        columns = self.data_loader.RESTAURANT_FIELDS + ["category_y", "name_y"]
+        restaurants = self.data_loader.restaurant_records(
+            record for batch in self._record_batches(data, batch_size, columns) for record in batch
+        )
+        print(f"Indexing {len(restaurants)} restaurants.")
+        for i in range(0, len(restaurants), batch_size):
+            chunk = restaurants[i : i + batch_size]
+            vectors = self.embedding.embed_documents(
+                [self.data_loader.format_restaurant_text(record) for record in chunk]
+            )
+            yield [
+                models.PointStruct(id=int(record["restaurant_id"]), vector=vector, payload=self._payload(record))
+                for record, vector in zip(chunk, vectors)
+            ]
+
+    def index_data(
+        self,
+        collection_name: Optional[str] = None,
+        data: Optional[List[Dict[str, Any]]] = None,
+        dedupe: bool = True,
+        batch_size: int = 4096,
+    ):
+        """Indexes restaurants and menu items on a background thread.
+
+        Rows are streamed from the dataset snapshot (or sliced from ``data``)
+        and embedded and upserted ``batch_size`` rows at a time, so memory use
+        doesn't grow with the dataset.
+
+        With ``dedupe`` (the default), menu items are embedded from their
+        location-independent text only, once per distinct text, and rely on the
+        two-stage search for restaurant and location matching. Without it every
+        row is embedded from its full text, as for single-stage search.
+
+        Either way the restaurant collection is built, so the engine switches
+        to two-stage search.
+        """
         coll = collection_name or self.default_collection
-        data = data or self.data_loader.load_and_merge_data()
+        # Deduped item vectors carry no restaurant or location, so single-stage search over them degrades
+        self.hierarchical = True
+        self._zip_centroids.pop(coll, None)
+
+        print(f"Indexing restaurants and menu items into '{coll}'.")
+        # Restaurants go first so the two-stage search is usable as soon as possible
+        return self.vector_store.upsert_collections_async([
+            (self.restaurant_collection_for(coll), self._restaurant_point_batches(data, batch_size)),
+            (coll, self._item_point_batches(coll, data, dedupe, batch_size)),
+        ])
+
+    def zip_centroids(self, collection_name: Optional[str] = None) -> Dict[str, Tuple[float, float]]:
+        """Mean restaurant coordinates per ZIP code, read from the index payloads once.
 
-        points = []
-        for idx, record in enumerate(data):
-            text = self.data_loader.format_embedding_text(record)
-            doc = self.embedding.embed_text(text)
+        Unlike the dataset, the index is also there on nodes restored from
+        snapshots without the source CSVs.
+        """
+        cache_key = collection_name or self.default_collection
+        if cache_key in self._zip_centroids:
+            return self._zip_centroids[cache_key]
 
-            point = models.PointStruct(
-                id=idx,
-                vector=doc,
-                payload=record
+        # The restaurant collection has one point per location; older indexes only have menu items
+        coll = cache_key
+        if self.hierarchical:
+            coll = self.restaurant_collection_for(coll)
+        if not self.vector_store.client.collection_exists(collection_name=coll):
+            return {}
+
+        sums: Dict[str, List[float]] = {}
+        offset = None
+        while True:
+            points, offset = self.vector_store.client.scroll(
+                collection_name=coll,
+                limit=10_000,
+                offset=offset,
+                with_payload=["zip_code", self.GEO_FIELD],
+                with_vectors=False,
             )
-            points.append(point)
+            for point in points:
+                zip_code = self.data_loader.normalize_zip(point.payload.get("zip_code"))
+                geo = point.payload.get(self.GEO_FIELD)
+                if zip_code is None or geo is None:
+                    continue
+                total = sums.setdefault(zip_code, [0.0, 0.0, 0])
+                total[0] += geo["lat"]
+                total[1] += geo["lon"]
+                total[2] += 1
+            if offset is None:
+                break
+
+        self._zip_centroids[cache_key] = {
+            zip_code: (lat / count, lng / count) for zip_code, (lat, lng, count) in sums.items()
+        }
+        return self._zip_centroids[cache_key]
 
-        # self.vector_store.upsert_points(coll, points)
-        return self.vector_store.upsert_points_async(coll, points)
+    def geo_filter(
+        self,
+        center: Optional[Tuple[float, float]] = None,
+        radius_km: Optional[float] = None,
+        zip_code: Optional[str] = None,
+        collection_name: Optional[str] = None,
+    ) -> Optional[models.Filter]:
+        """Server-side filter restricting results to a radius around a point or ZIP centroid."""
+        if center is None and zip_code is not None:
+            centroid = self.zip_centroids(collection_name).get(self.data_loader.normalize_zip(zip_code))
+            if centroid is None:
+                raise UnknownZipCodeError(f"Unknown zip code: {zip_code}")
+            center = centroid
+        if center is None:
+            return None
+
+        lat, lng = center
+        if radius_km is None:
+            radius_km = self.DEFAULT_RADIUS_KM
+        return models.Filter(must=[
+            models.FieldCondition(
+                key=self.GEO_FIELD,
+                geo_radius=models.GeoRadius(
+                    center=models.GeoPoint(lat=lat, lon=lng),
+                    radius=radius_km * 1000,
+                ),
+            )
+        ])
 
-        print(f"Indexed {len(points)} records into '{coll}'.")
+    def search(
+        self,
+        query: str,
+        collection_name: Optional[str] = None,
+        num_results: int = 5,
+        center: Optional[Tuple[float, float]] = None,
+        radius_km: Optional[float] = None,
+        zip_code: Optional[str] = None,
+    ):
+        if self.hierarchical:
+            return self.search_hierarchical(
+                query, collection_name, num_results,
+                center=center, radius_km=radius_km, zip_code=zip_code,
+            )
 
-    def search(self, query: str, collection_name: Optional[str] = None, num_results: int = 5):
         coll = collection_name or self.default_collection
-        query_doc = self.embedding.embed_text(query)
+        query_vector = self.embedding.embed_query(query)
         return self.vector_store.client.query_points(
             collection_name=coll,
-            query=query_doc,
+            query=query_vector,
+            query_filter=self.geo_filter(center, radius_km, zip_code, coll),
+            limit=num_results,
+            with_payload=True,
+        )
+
+    def search_hierarchical(
+        self,
+        query: str,
+        collection_name: Optional[str] = None,
+        num_results: int = 5,
+        num_restaurants: int = 20,
+        items_per_restaurant: int = 2,
+        center: Optional[Tuple[float, float]] = None,
+        radius_km: Optional[float] = None,
+        zip_code: Optional[str] = None,
+    ) -> QueryResponse:
+        """Two-stage search over the restaurant and menu-item collections.
+
+        Stage one finds candidate restaurants in the small restaurant-level
+        collection. Stage two scores only the menu items of those restaurants,
+        grouped by restaurant_id so a single restaurant cannot fill the top-k.
+        """
+        coll = collection_name or self.default_collection
+        query_vector = self.embedding.embed_query(query)
+
+        candidates = self.vector_store.client.query_points(
+            collection_name=self.restaurant_collection_for(coll),
+            query=query_vector,
+            query_filter=self.geo_filter(center, radius_km, zip_code, coll),
+            limit=num_restaurants,
+            with_payload=["restaurant_id"],
+        )
+        restaurant_ids = [point.payload["restaurant_id"] for point in candidates.points]
+        if not restaurant_ids:
+            return QueryResponse(points=[])
+
+        groups = self.vector_store.client.query_points_groups(
+            collection_name=coll,
+            query=query_vector,
+            group_by="restaurant_id",
+            query_filter=models.Filter(must=[
+                models.FieldCondition(key="restaurant_id", match=models.MatchAny(any=restaurant_ids))
+            ]),
             limit=num_results,
+            group_size=items_per_restaurant,
             with_payload=True,
         )
+        hits = [hit for group in groups.groups for hit in group.hits]
+        hits.sort(key=lambda hit: hit.score, reverse=True)
+        return QueryResponse(points=hits[:num_results])
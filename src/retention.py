@@ -0,0 +1,26 @@
+import os
+import argparse
+from dotenv import load_dotenv
+
+os.environ['RUN_TIMEZONE_CHECK'] = '0'
+
+from db import ensure_conversation_partitions, drop_expired_partitions
+
+load_dotenv()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create upcoming conversations partitions and drop expired ones"
+    )
+    parser.add_argument(
+        "--retention-months", type=int, default=int(os.getenv("RETENTION_MONTHS", "12")),
+        help="Number of full months of conversations to keep"
+    )
+    args = parser.parse_args()
+
+    ensure_conversation_partitions()
+    dropped = drop_expired_partitions(args.retention_months)
+    if dropped:
+        print(f"Dropped partitions: {', '.join(dropped)}")
+    else:
+        print("No partitions to drop.")
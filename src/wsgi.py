@@ -0,0 +1,15 @@
+import os
+from time import time
+
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+t0 = time()
+
+from app import app
+import rag
+
+# With gunicorn's preload_app this runs once in the master before forking, so
+# workers share the loaded model and index handles copy-on-write
+rag.warmup()
+
+STARTUP_SECONDS = time() - t0
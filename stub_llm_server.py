@@ -0,0 +1,133 @@
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+
+from flask import Flask, request, jsonify
+
+
+app = Flask(__name__)
+
+# Runtime settings, overridden from the command line in main()
+settings = {
+    "latency_ms": 300.0,
+    "latency_jitter_ms": 100.0,
+    "per_token_latency_ms": 0.0,
+    "completion_tokens": 150,
+    "error_rate": 0.0,
+}
+
+# Mimics the provider's automatic prefix caching: prompts of at least 1024 tokens
+# are cached in 128-token increments and later prompts sharing a prefix hit it
+CACHE_MIN_TOKENS = 1024
+CACHE_INCREMENT_TOKENS = 128
+seen_prefixes = set()
+seen_prefixes_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    # Rough approximation of the tokenizer: ~4 characters per token
+    return max(1, len(text) // 4)
+
+
+def cached_prefix_tokens(prompt):
+    prompt_tokens = estimate_tokens(prompt)
+    cached = 0
+    with seen_prefixes_lock:
+        for tokens in range(CACHE_MIN_TOKENS, prompt_tokens + 1, CACHE_INCREMENT_TOKENS):
+            digest = hashlib.sha1(prompt[: tokens * 4].encode()).hexdigest()
+            if digest in seen_prefixes:
+                cached = tokens
+            else:
+                seen_prefixes.add(digest)
+    return cached
+
+
+def build_answer(prompt, response_format=None):
+    # The relevance judge expects parsable JSON back, everything else gets plain text
+    if response_format and response_format.get("type") == "json_schema":
+        # Only the batch judge asks for structured output
+        item_ids = re.findall(r"^\s*ID: (\d+)\s*$", prompt, re.MULTILINE)
+        return json.dumps({"evaluations": [
+            {"id": int(item_id), "Relevance": "RELEVANT", "Explanation": "Stub evaluation from the local LLM server"}
+            for item_id in item_ids
+        ]})
+    if '"Relevance"' in prompt:
+        return json.dumps({
+            "Relevance": "RELEVANT",
+            "Explanation": "Stub evaluation from the local LLM server",
+        })
+    return "This is a stub answer generated by the local LLM server for load testing."
+
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    data = request.get_json()
+    if not data or 'messages' not in data:
+        return jsonify({"error": {"message": "Missing messages", "type": "invalid_request_error"}}), 400
+
+    if settings["error_rate"] and random.random() < settings["error_rate"]:
+        return jsonify({"error": {"message": "Stub server injected error", "type": "server_error"}}), 500
+
+    prompt = "\n".join(str(m.get("content", "")) for m in data["messages"])
+    prompt_tokens = estimate_tokens(prompt)
+    completion_tokens = settings["completion_tokens"]
+
+    latency_ms = (
+        settings["latency_ms"]
+        + random.uniform(-settings["latency_jitter_ms"], settings["latency_jitter_ms"])
+        + settings["per_token_latency_ms"] * completion_tokens
+    )
+    time.sleep(max(0.0, latency_ms) / 1000)
+
+    return jsonify({
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": data.get("model", "stub-model"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": build_answer(prompt, data.get("response_format"))},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_prefix_tokens(prompt)},
+        },
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stub of the OpenAI chat completions API for offline load testing"
+    )
+    parser.add_argument("--port", type=int, default=5002, help="Port to listen on")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Base response latency")
+    parser.add_argument("--latency-jitter-ms", type=float, default=100.0, help="Uniform +/- jitter added to the latency")
+    parser.add_argument("--per-token-latency-ms", type=float, default=0.0, help="Extra latency per completion token")
+    parser.add_argument("--completion-tokens", type=int, default=150, help="Completion tokens reported in usage")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    args = parser.parse_args()
+
+    settings.update({
+        "latency_ms": args.latency_ms,
+        "latency_jitter_ms": args.latency_jitter_ms,
+        "per_token_latency_ms": args.per_token_latency_ms,
+        "completion_tokens": args.completion_tokens,
+        "error_rate": args.error_rate,
+    })
+
+    print(f"Stub LLM server listening on http://localhost:{args.port}/v1")
+    app.run(host="0.0.0.0", port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()